@@ -1,15 +1,36 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, Response, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
 import httpx
 from bs4 import BeautifulSoup
-from typing import List, Optional
-from cachetools import TTLCache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from cachetools import TLRUCache, TTLCache
 import asyncio
 from pydantic import BaseModel
 import re
 import base64
+import functools
+import heapq
+import hmac
+import json
+import math
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import unicodedata
+import zipfile
+from array import array
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape as xml_escape
 
 # Configuração Vercel: Tempo máximo de execução (5 minutos no plano gratuito)
 # Isso permite que requisições pesadas (scraping, proxy) tenham tempo suficiente
@@ -17,6 +38,356 @@ maxDuration = 300  # 300 segundos = 5 minutos
 
 app = FastAPI(title="LerMangas API", description="API rápida para scraping de mangás")
 
+# PRAZO (DEADLINE) POR REQUISIÇÃO
+# Cada requisição tem um prazo total (padrão por endpoint, ou pelo header X-Request-Timeout
+# em segundos) propagado para todas as chamadas ao upstream e laços de retry.
+# O handler é cancelado se o cliente desconectar ou se o prazo estourar antes da resposta.
+
+REQUEST_DEADLINES = [
+    (re.compile(r"/archive$"), None),  # downloads em streaming podem ser longos
+    (re.compile(r"^/api/watch/stream"), None),  # conexão SSE permanece aberta
+    (re.compile(r"^/api/(proxy-image|mangadex-proxy)"), 20.0),
+    (re.compile(r"^/api/search/federated"), 8.0),
+    (re.compile(r"^/api/home"), 10.0),
+]
+DEFAULT_REQUEST_DEADLINE = 15.0
+MAX_REQUEST_DEADLINE = 60.0
+DEADLINE_GRACE = 1.0  # folga antes de cortar um handler que ignorou o prazo
+
+# Prazo (time.monotonic) da requisição atual
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=504, detail="Prazo da requisição esgotado")
+
+def time_remaining() -> Optional[float]:
+    """Segundos restantes até o prazo da requisição atual (None = sem prazo)"""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def deadline_expired() -> bool:
+    remaining = time_remaining()
+    return remaining is not None and remaining <= 0
+
+def upstream_timeout(default: float) -> float:
+    """Timeout de uma chamada ao upstream limitado pelo tempo restante da requisição"""
+    remaining = time_remaining()
+    if remaining is None:
+        return default
+    return max(0.05, min(default, remaining))
+
+async def with_deadline(awaitable):
+    """Aguarda respeitando o prazo da requisição (DeadlineExceeded ao estourar)"""
+    remaining = time_remaining()
+    if remaining is None:
+        return await awaitable
+    if remaining <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded()
+    try:
+        return await asyncio.wait_for(awaitable, timeout=remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
+
+def request_budget(path: str, header_value: Optional[bytes]) -> Optional[float]:
+    """Prazo em segundos para a requisição (header X-Request-Timeout ou padrão do endpoint)"""
+    if header_value:
+        try:
+            return max(0.1, min(float(header_value), MAX_REQUEST_DEADLINE))
+        except ValueError:
+            pass
+    for pattern, budget in REQUEST_DEADLINES:
+        if pattern.search(path):
+            return budget
+    return DEFAULT_REQUEST_DEADLINE
+
+class RequestDeadlineMiddleware:
+    """Middleware ASGI: aplica o prazo da requisição e cancela o handler se o cliente sair"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget = request_budget(scope["path"], dict(scope["headers"]).get(b"x-request-timeout"))
+        token = request_deadline.set(time.monotonic() + budget if budget else None)
+
+        # Ler o corpo antes, para poder vigiar a desconexão em paralelo ao handler
+        body_messages = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                request_deadline.reset(token)
+                return
+            body_messages.append(message)
+            if not message.get("more_body"):
+                break
+
+        disconnected = asyncio.Event()
+        response_started = False
+
+        async def replay_receive():
+            if body_messages:
+                return body_messages.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        handler = asyncio.ensure_future(self.app(scope, replay_receive, tracking_send))
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            timeout = budget + DEADLINE_GRACE if budget else None
+            done, _ = await asyncio.wait({handler, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if handler in done:
+                handler.result()
+                return
+
+            if response_started:
+                # Resposta em streaming já começou: ela mesma trata a desconexão
+                await handler
+                return
+
+            handler.cancel()
+            await asyncio.gather(handler, return_exceptions=True)
+            if watcher in done:
+                print(f"[INFO] Cliente desconectou, cancelando {scope['path']}")
+                return
+
+            print(f"[WARN] Prazo de {budget}s esgotado em {scope['path']}")
+            await JSONResponse(status_code=504, content={"detail": "Prazo da requisição esgotado"})(
+                scope, replay_receive, send
+            )
+        finally:
+            watcher.cancel()
+            request_deadline.reset(token)
+
+# Adicionado antes do CORS para que as respostas 504 também recebam os headers de CORS
+app.add_middleware(RequestDeadlineMiddleware)
+
+# PERFILAMENTO SOB DEMANDA
+# Liga por requisição com o header X-Profile (exige X-Admin-Token = ADMIN_TOKEN) ou por
+# amostragem (PROFILE_SAMPLE_RATE, só com ADMIN_TOKEN definido). Registra o tempo próprio de cada etapa (upstream,
+# validate, parse, extract, handler, serialize) e, com "X-Profile: flamegraph", amostras
+# da pilha do event loop em formato "folded" (flamegraph.pl / speedscope).
+# Os perfis ficam num buffer circular consultado em /api/admin/profiles.
+# Sem ADMIN_TOKEN nada disso é instalado.
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_BUFFER_SIZE = 100
+PROFILE_MAX_SPANS = 500
+PROFILE_STACK_INTERVAL = 0.005  # segundos entre amostras da pilha
+PROFILE_MAX_STACKS = 5000
+
+# Sem token ninguém consegue ler os perfis: amostrar só gastaria memória
+if PROFILE_SAMPLE_RATE > 0 and not ADMIN_TOKEN:
+    print("[WARN] PROFILE_SAMPLE_RATE ignorado: defina ADMIN_TOKEN para consultar os perfis em /api/admin/profiles")
+    PROFILE_SAMPLE_RATE = 0.0
+PROFILING_ENABLED = bool(ADMIN_TOKEN)
+
+class RequestProfile:
+    """Etapas medidas de uma requisição"""
+
+    _ids = 0
+
+    def __init__(self, method: str, path: str, query: str, flamegraph: bool):
+        RequestProfile._ids += 1
+        self.id = RequestProfile._ids
+        self.method = method
+        self.path = path
+        self.query = query
+        self.created = time.time()
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status: Optional[int] = None
+        self.spans: List[Tuple[str, float, float]] = []  # (etapa, início, duração) em segundos
+        self.self_time: Dict[str, float] = {}  # etapa -> tempo próprio (sem as etapas internas)
+        self.flamegraph = flamegraph
+        self.stacks: Optional[Dict[str, int]] = None
+
+    def record(self, name: str, start: float, duration: float, own: float):
+        if len(self.spans) < PROFILE_MAX_SPANS:
+            self.spans.append((name, start - self.started, duration))
+        self.self_time[name] = self.self_time.get(name, 0.0) + max(0.0, own)
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.self_time.items())
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "query": self.query,
+            "status": self.status,
+            "created": self.created,
+            "total_ms": None if self.duration is None else round(self.duration * 1000, 1),
+            "breakdown_ms": {name: round(seconds * 1000, 1) for name, seconds in self.self_time.items()},
+            "flamegraph": self.stacks is not None,
+        }
+
+# Perfil da requisição atual e tempo acumulado das etapas internas à etapa aberta
+request_profile: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+_open_span: ContextVar[Optional[list]] = ContextVar("open_span", default=None)
+profiles: deque = deque(maxlen=PROFILE_BUFFER_SIZE)
+_NO_SPAN = nullcontext()
+
+@contextmanager
+def _profiled_span(profile: RequestProfile, name: str):
+    parent = _open_span.get()
+    children = [0.0]
+    token = _open_span.set(children)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        _open_span.reset(token)
+        if parent is not None:
+            parent[0] += duration
+        profile.record(name, start, duration, duration - children[0])
+
+def profile_span(name: str):
+    """Mede uma etapa da requisição atual (não faz nada se ela não estiver sendo perfilada)"""
+    profile = request_profile.get()
+    if profile is None:
+        return _NO_SPAN
+    return _profiled_span(profile, name)
+
+def make_soup(html: str) -> BeautifulSoup:
+    with profile_span("parse"):
+        return BeautifulSoup(html, 'lxml')
+
+class StackSampler:
+    """Amostra a pilha da thread do event loop em intervalos fixos (uma sessão por vez)"""
+
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.thread_id = threading.get_ident()
+        self.counts: Counter = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+
+    @classmethod
+    def start(cls) -> Optional["StackSampler"]:
+        if not cls._lock.acquire(blocking=False):
+            return None  # outra requisição já está sendo amostrada
+        sampler = cls()
+        sampler.thread.start()
+        return sampler
+
+    def run(self):
+        while not self.stopped.wait(PROFILE_STACK_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < 128:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            if key in self.counts or len(self.counts) < PROFILE_MAX_STACKS:
+                self.counts[key] += 1
+
+    def stop(self) -> Dict[str, int]:
+        self.stopped.set()
+        self.thread.join()
+        StackSampler._lock.release()
+        return dict(self.counts)
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+class ProfilingMiddleware:
+    """Middleware ASGI que cria o perfil da requisição e devolve o resumo em Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        mode = headers.get(b"x-profile")
+        token = headers.get(b"x-admin-token")
+        if mode is not None and is_admin(token.decode("latin-1") if token else None):
+            flamegraph = mode.strip().lower() == b"flamegraph"
+        elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            flamegraph = False
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"), flamegraph)
+        context_token = request_profile.set(profile)
+        sampler = StackSampler.start() if flamegraph else None
+
+        async def profiled_send(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"server-timing", profile.server_timing().encode("latin-1")),
+                        (b"x-profile-id", str(profile.id).encode("latin-1")),
+                    ],
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            request_profile.reset(context_token)
+            if sampler is not None:
+                profile.stacks = sampler.stop()
+            profile.duration = time.perf_counter() - profile.started
+            profiles.append(profile)
+
+class ProfiledRoute(APIRoute):
+    """Rota que separa o tempo do endpoint ("handler") da validação/serialização da resposta"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def profiled_endpoint(*args, **kw):
+                with profile_span("handler"):
+                    return await endpoint(*args, **kw)
+            super().__init__(path, profiled_endpoint, **kwargs)
+        else:
+            super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request: Request) -> Response:
+            with profile_span("serialize"):
+                return await handler(request)
+
+        return profiled_handler
+
+if PROFILING_ENABLED:
+    app.router.route_class = ProfiledRoute
+    app.add_middleware(ProfilingMiddleware)
+
 # Configurar CORS para o frontend acessar
 app.add_middleware(
     CORSMiddleware,
@@ -26,14 +397,140 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Cache com TTL de 5 minutos (300 segundos)
-cache = TTLCache(maxsize=100, ttl=300)
+class RevalidatingCache:
+    """
+    TTLCache que também guarda os validadores do upstream (ETag/Last-Modified).
+    Entradas com validadores continuam guardadas após expirar, permitindo renovar
+    com um GET condicional (304 Not Modified) em vez de baixar tudo de novo.
+    `ttl_for(key)`, se informado, define o TTL de cada entrada no momento em que é gravada.
+    `stale_bytes`/`sizeof(value)`, se informados, limitam as entradas guardadas para
+    revalidação por tamanho total em vez de quantidade (valores que já saíram de `fresh`
+    continuam ocupando memória até a revalidação expirar).
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stale_ttl: float, ttl_for=None, stale_bytes: Optional[int] = None, sizeof=None):
+        if ttl_for is None:
+            self.fresh = TTLCache(maxsize=maxsize, ttl=ttl)
+        else:
+            self.fresh = TLRUCache(maxsize=maxsize, ttu=lambda key, value, now: now + ttl_for(key), timer=time.monotonic)
+        if stale_bytes is None:
+            self.stale = TTLCache(maxsize=maxsize, ttl=stale_ttl)
+        else:
+            self.stale = TTLCache(maxsize=stale_bytes, ttl=stale_ttl, getsizeof=lambda entry: sizeof(entry[0]))
+        self.updated = TTLCache(maxsize=maxsize, ttl=stale_ttl)  # quando cada valor foi confirmado no upstream
+
+    def __contains__(self, key):
+        return key in self.fresh
+
+    def __getitem__(self, key):
+        return self.fresh[key]
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        self.stale.pop(key, None)
+        del self.fresh[key]
+
+    def __len__(self):
+        return len(self.fresh)
+
+    def get(self, key, default=None):
+        return self.fresh.get(key, default)
+
+    def pop(self, key, default=None):
+        self.stale.pop(key, None)
+        return self.fresh.pop(key, default)
+
+    def expire(self, key):
+        """Tira a entrada de validade mas mantém os validadores para o próximo GET condicional"""
+        self.fresh.pop(key, None)
+
+    def updated_at(self, key) -> Optional[float]:
+        """Horário (epoch) em que o valor foi baixado ou revalidado pela última vez"""
+        return self.updated.get(key)
+
+    def set(self, key, value, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self.fresh[key] = value
+        self.updated[key] = time.time()
+        if etag or last_modified:
+            try:
+                self.stale[key] = (value, etag, last_modified)
+            except ValueError:  # maior que todo o orçamento de revalidação
+                self.stale.pop(key, None)
+        else:
+            self.stale.pop(key, None)
+
+    def store_response(self, key, value, response: httpx.Response):
+        """Guarda o valor junto com os validadores da resposta do upstream"""
+        self.set(key, value, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+    def conditional_headers(self, key) -> dict:
+        """Headers If-None-Match/If-Modified-Since para uma entrada expirada"""
+        entry = self.stale.get(key)
+        if not entry:
+            return {}
+        _, etag, last_modified = entry
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def revalidate(self, key):
+        """Upstream respondeu 304: devolve o valor antigo com a vida renovada"""
+        entry = self.stale.get(key)
+        if entry is None:
+            return None
+        value, etag, last_modified = entry
+        self.set(key, value, etag, last_modified)
+        return value
+
+# Cache de resultados já extraídos (MangaDetail, ChapterImages, HomeData, listas) com TTL de 5 minutos.
+# Guarda só os objetos prontos, não o HTML; entradas expiradas ficam 1 dia para revalidação.
+# Detalhes e capítulos ficam bem mais tempo enquanto o sitemap estiver sendo acompanhado
+# (ver SINCRONIZAÇÃO PELO SITEMAP), já que mudanças passam a invalidar a entrada na hora
+CACHE_TTL = 300
+SITEMAP_PAGE_TTL = int(os.getenv("SITEMAP_PAGE_TTL", str(6 * 3600)))
+
+def cached_page_ttl(key: str) -> float:
+    if key.startswith(("detail_", "chapter_")) and sitemap_sync.healthy():
+        return SITEMAP_PAGE_TTL
+    return CACHE_TTL
+
+cache = RevalidatingCache(maxsize=1000, ttl=CACHE_TTL, stale_ttl=86400, ttl_for=cached_page_ttl)
+
+# HTML bruto opcional (debug/reprocessamento), limitado pelo tamanho total em RAW_HTML_CACHE_MB (0 = desligado)
+RAW_HTML_CACHE_BYTES = int(float(os.getenv("RAW_HTML_CACHE_MB", "0")) * 1024 * 1024)
+raw_html_cache = TTLCache(maxsize=RAW_HTML_CACHE_BYTES, ttl=300, getsizeof=len) if RAW_HTML_CACHE_BYTES else None
+
+# Cache de imagens com TTL de 24 horas (86400 segundos); revalidáveis por 7 dias.
+# As cópias guardadas para revalidação têm orçamento próprio em bytes (IMAGE_STALE_CACHE_MB),
+# senão imagens já expulsas do cache válido somariam até outras 1000 na memória
+IMAGE_STALE_CACHE_BYTES = int(float(os.getenv("IMAGE_STALE_CACHE_MB", "64")) * 1024 * 1024)
+image_cache = RevalidatingCache(
+    maxsize=1000, ttl=86400, stale_ttl=7 * 86400,
+    stale_bytes=IMAGE_STALE_CACHE_BYTES, sizeof=lambda data: len(data["content"]),
+)
+
+# URL base do site (sobrescrevível para apontar para o upstream simulado do loadtest/)
+BASE_URL = os.getenv("LERMANGAS_BASE_URL", "https://lermangas.me")
 
-# Cache de imagens com TTL de 24 horas (86400 segundos)
-image_cache = TTLCache(maxsize=1000, ttl=86400)
+# MangaDex (API oficial e identificação exigida pela documentação)
+MANGADEX_API_BASE = "https://api.mangadex.org"
+MANGADEX_UPLOADS_BASE = "https://uploads.mangadex.org"
+MANGADEX_USER_AGENT = "MangaVerso/1.0 (https://github.com/thierrysuceli/mangaverso)"
 
-# URL base do site
-BASE_URL = "https://lermangas.me"
+# Headers para imagens do MangaDex conforme documentação
+# https://api.mangadex.org/docs/2-limitations/
+MANGADEX_IMAGE_HEADERS = {
+    "User-Agent": MANGADEX_USER_AGENT,
+    "Accept": "image/avif,image/webp,image/apng,image/*,*/*;q=0.8",
+    "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
+    "Referer": "https://mangadex.org/",
+    # NÃO incluir Via header - MangaDex bloqueia proxies não-transparentes
+}
 
 # Lista de User-Agents para rotação (anti-bot)
 USER_AGENTS = [
@@ -69,6 +566,64 @@ def get_random_headers():
 # Headers padrão (manter compatibilidade)
 HEADERS = get_random_headers()
 
+# Cliente HTTP compartilhado (pool de conexões keep-alive reaproveitado entre requisições)
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Retorna o cliente HTTP compartilhado, criando-o sob demanda"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=20.0,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _http_client
+
+@app.on_event("shutdown")
+async def close_http_client():
+    if _http_client is not None:
+        await _http_client.aclose()
+
+# Tarefas em segundo plano (referência forte para não serem coletadas pelo GC)
+_background_tasks = set()
+
+def spawn_background(coro) -> asyncio.Task:
+    """Dispara uma corrotina sem aguardar o resultado"""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+class RateLimiter:
+    """Token bucket assíncrono para respeitar o limite de requisições de uma API externa"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate  # tokens por segundo
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block_for(self, seconds: float):
+        """Pausa todas as requisições (usado quando a API responde 429)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
 # Modelos de resposta
 class MangaCard(BaseModel):
     title: str
@@ -98,23 +653,261 @@ class MangaDetail(BaseModel):
     badges: List[str] = []
     chapters: List[Chapter] = []
 
+class PageDimensions(BaseModel):
+    url: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    bytes: Optional[int] = None  # tamanho total do arquivo
+    format: Optional[str] = None  # "jpeg", "png", "webp" ou "gif"
+
 class ChapterImages(BaseModel):
     manga_title: str
     chapter_number: str
     images: List[str] = []
     prev_chapter: Optional[str] = None
     next_chapter: Optional[str] = None
+    pages: Optional[List[PageDimensions]] = None  # só com ?dimensions=true
 
 class HomeData(BaseModel):
     popular: List[MangaCard] = []
     trending: List[MangaCard] = []
     recent_updates: List[MangaCard] = []
+    partial: bool = False  # prazo esgotou antes de carregar tudo
+
+class MangaBatch(BaseModel):
+    results: Dict[str, MangaDetail] = {}
+    missing: List[str] = []  # slugs que não ficaram prontos no prazo ou falharam no upstream
+    partial: bool = False
 
 class Genre(BaseModel):
     name: str
     slug: str
     count: Optional[int] = None
 
+class SearchSource(BaseModel):
+    source: str  # "mangadex" ou "lermanga"
+    id: str  # ID do MangaDex ou slug do LerManga
+    url: Optional[str] = None
+    cover_image: str = ""
+
+class FederatedSearchResult(BaseModel):
+    title: str
+    alt_titles: List[str] = []
+    cover_image: str = ""
+    description: Optional[str] = None
+    status: Optional[str] = None
+    rating: Optional[float] = None
+    latest_chapter: Optional[str] = None
+    score: float = 0.0
+    sources: List[SearchSource] = []
+
+class FederatedSearchResponse(BaseModel):
+    query: str
+    results: List[FederatedSearchResult] = []
+    source_status: Dict[str, str] = {}  # fonte -> "ok", "timeout" ou "error"
+    partial: bool = False
+
+# REPRESENTAÇÃO COMPACTA DO CACHE
+# Os objetos extraídos ficam no cache em registros com __slots__: capítulos em colunas
+# (números em array de floats quando possível), título/URL do capítulo omitidos quando
+# seguem o padrão "Capítulo N" / {BASE_URL}/manga/{slug}/capitulo-N/, URLs do site sem o
+# prefixo BASE_URL e gêneros/badges/datas internados. Os modelos públicos só são
+# montados de novo (materialize) na hora de responder.
+
+DERIVED = True  # marca um valor que é reconstruído a partir dos demais campos
+
+# Marca o BASE_URL removido; não aparece em URLs reais, então "/x" e "//cdn/x" voltam intactas
+SITE_URL_MARKER = "\0"
+
+def compress_url(url: Optional[str]) -> Optional[str]:
+    """URLs do próprio site viram "\0/manga/..." (prefixo BASE_URL trocado pela marca)"""
+    if url and url.startswith(BASE_URL + "/"):
+        return SITE_URL_MARKER + url[len(BASE_URL):]
+    return url
+
+def expand_url(url: Optional[str]) -> Optional[str]:
+    if url and url.startswith(SITE_URL_MARKER):
+        return BASE_URL + url[len(SITE_URL_MARKER):]
+    return url
+
+def intern_all(values) -> tuple:
+    return tuple(sys.intern(value) for value in values)
+
+def intern_optional(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value else value
+
+def format_chapter_number(number: float) -> str:
+    return str(int(number)) if number.is_integer() else repr(number)
+
+def chapter_url(slug: str, number: str) -> str:
+    return f"{BASE_URL}/manga/{slug}/capitulo-{number}/"
+
+class CompactChapters:
+    """Lista de capítulos em colunas"""
+
+    __slots__ = ("numbers", "titles", "urls", "release_dates")
+
+    def __init__(self, chapters: List[Chapter], slug: str):
+        numbers = [chapter.number for chapter in chapters]
+        try:
+            packed = array("d", (float(number) for number in numbers))
+            if any(format_chapter_number(value) != number for value, number in zip(packed, numbers)):
+                raise ValueError
+            self.numbers = packed
+        except ValueError:
+            self.numbers = intern_all(numbers)  # números não numéricos ("Extra", "012")
+
+        titles = [DERIVED if chapter.title == f"Capítulo {chapter.number}" else chapter.title for chapter in chapters]
+        self.titles = None if all(title is DERIVED for title in titles) else tuple(titles)
+        urls = [DERIVED if chapter.url == chapter_url(slug, chapter.number) else compress_url(chapter.url) for chapter in chapters]
+        self.urls = None if all(url is DERIVED for url in urls) else tuple(urls)
+        self.release_dates = tuple(intern_optional(chapter.release_date) for chapter in chapters)
+
+    def materialize(self, slug: str) -> List[Chapter]:
+        if isinstance(self.numbers, array):
+            numbers = [format_chapter_number(value) for value in self.numbers]
+        else:
+            numbers = list(self.numbers)
+        chapters = []
+        for i, number in enumerate(numbers):
+            title = DERIVED if self.titles is None else self.titles[i]
+            url = DERIVED if self.urls is None else self.urls[i]
+            chapters.append(Chapter.model_construct(
+                number=number,
+                title=f"Capítulo {number}" if title is DERIVED else title,
+                url=chapter_url(slug, number) if url is DERIVED else expand_url(url),
+                release_date=self.release_dates[i],
+            ))
+        return chapters
+
+class CompactCard:
+    __slots__ = ("title", "slug", "url", "cover_image", "rating", "latest_chapter", "badges")
+
+    def __init__(self, card: MangaCard):
+        self.title = card.title
+        self.slug = card.slug
+        self.url = DERIVED if card.url == f"{BASE_URL}/manga/{card.slug}/" else compress_url(card.url)
+        self.cover_image = compress_url(card.cover_image)
+        self.rating = card.rating
+        self.latest_chapter = intern_optional(card.latest_chapter)
+        self.badges = intern_all(card.badges)
+
+    def materialize(self) -> MangaCard:
+        return MangaCard.model_construct(
+            title=self.title,
+            slug=self.slug,
+            url=f"{BASE_URL}/manga/{self.slug}/" if self.url is DERIVED else expand_url(self.url),
+            cover_image=expand_url(self.cover_image),
+            rating=self.rating,
+            latest_chapter=self.latest_chapter,
+            badges=list(self.badges),
+        )
+
+class CompactCardList:
+    __slots__ = ("cards",)
+
+    def __init__(self, cards: List[MangaCard]):
+        self.cards = tuple(CompactCard(card) for card in cards)
+
+    def materialize(self) -> List[MangaCard]:
+        return [card.materialize() for card in self.cards]
+
+class CompactDetail:
+    __slots__ = ("title", "slug", "cover_image", "rating", "summary", "author", "artist", "status", "genres", "badges", "chapters")
+
+    def __init__(self, detail: MangaDetail):
+        self.title = detail.title
+        self.slug = detail.slug
+        self.cover_image = compress_url(detail.cover_image)
+        self.rating = detail.rating
+        self.summary = detail.summary
+        self.author = intern_optional(detail.author)
+        self.artist = intern_optional(detail.artist)
+        self.status = intern_optional(detail.status)
+        self.genres = intern_all(detail.genres)
+        self.badges = intern_all(detail.badges)
+        self.chapters = CompactChapters(detail.chapters, detail.slug) if detail.chapters else None
+
+    def materialize(self) -> MangaDetail:
+        return MangaDetail.model_construct(
+            title=self.title,
+            slug=self.slug,
+            cover_image=expand_url(self.cover_image),
+            rating=self.rating,
+            summary=self.summary,
+            author=self.author,
+            artist=self.artist,
+            status=self.status,
+            genres=list(self.genres),
+            badges=list(self.badges),
+            chapters=self.chapters.materialize(self.slug) if self.chapters else [],
+        )
+
+class CompactChapterImages:
+    """URLs das páginas guardadas como prefixo comum + sufixos"""
+
+    __slots__ = ("manga_title", "chapter_number", "prefix", "suffixes", "prev_chapter", "next_chapter")
+
+    def __init__(self, chapter: ChapterImages):
+        self.manga_title = chapter.manga_title
+        self.chapter_number = chapter.chapter_number
+        prefix = os.path.commonprefix(chapter.images) if len(chapter.images) > 1 else ""
+        prefix = prefix[:prefix.rfind("/") + 1]
+        self.prefix = compress_url(prefix)
+        if prefix:
+            self.suffixes = tuple(image[len(prefix):] for image in chapter.images)
+        else:
+            self.suffixes = tuple(compress_url(image) for image in chapter.images)
+        self.prev_chapter = compress_url(chapter.prev_chapter)
+        self.next_chapter = compress_url(chapter.next_chapter)
+
+    def materialize(self) -> ChapterImages:
+        prefix = expand_url(self.prefix)
+        return ChapterImages.model_construct(
+            manga_title=self.manga_title,
+            chapter_number=self.chapter_number,
+            images=[prefix + suffix if prefix else expand_url(suffix) for suffix in self.suffixes],
+            prev_chapter=expand_url(self.prev_chapter),
+            next_chapter=expand_url(self.next_chapter),
+        )
+
+class CompactHome:
+    __slots__ = ("popular", "trending", "recent_updates", "partial")
+
+    def __init__(self, home: HomeData):
+        self.popular = CompactCardList(home.popular)
+        self.trending = CompactCardList(home.trending)
+        self.recent_updates = CompactCardList(home.recent_updates)
+        self.partial = home.partial
+
+    def materialize(self) -> HomeData:
+        return HomeData.model_construct(
+            popular=self.popular.materialize(),
+            trending=self.trending.materialize(),
+            recent_updates=self.recent_updates.materialize(),
+            partial=self.partial,
+        )
+
+COMPACT_TYPES = (CompactDetail, CompactChapterImages, CompactHome, CompactCardList)
+
+def compact(value):
+    """Converte um resultado extraído na forma compacta guardada no cache"""
+    if isinstance(value, MangaDetail):
+        return CompactDetail(value)
+    if isinstance(value, ChapterImages):
+        return CompactChapterImages(value)
+    if isinstance(value, HomeData):
+        return CompactHome(value)
+    if isinstance(value, list) and value and all(isinstance(item, MangaCard) for item in value):
+        return CompactCardList(value)
+    return value
+
+def materialize(value):
+    """Monta de novo o modelo público a partir da forma compacta"""
+    if isinstance(value, COMPACT_TYPES):
+        return value.materialize()
+    return value
+
 # Funções auxiliares de parsing
 def extract_manga_card(item) -> MangaCard:
     """Extrai dados de um card de mangá"""
@@ -189,11 +982,124 @@ def get_proxied_url(url: str) -> str:
     import random
     return random.choice(proxies)
 
+class NegativeCache:
+    """
+    Falhas recentes do upstream por URL e por host. Enquanto a entrada estiver ativa
+    a requisição é respondida na hora com o estado da falha, sem refazer a cascata de
+    proxies/retries. O TTL dobra a cada falha seguida e volta ao início após um sucesso.
+    """
+
+    def __init__(self, base_ttl: Dict[str, float], max_ttl: float, maxsize: int = 2000):
+        self.base_ttl = base_ttl
+        self.max_ttl = max_ttl
+        # O contador de falhas sobrevive ao fim do TTL (por 1 dia) para o backoff crescer
+        self.entries = TTLCache(maxsize=maxsize, ttl=86400)
+
+    def record(self, key: str, state: str) -> float:
+        entry = self.entries.get(key)
+        failures = entry["failures"] + 1 if entry else 1
+        ttl = min(self.max_ttl, self.base_ttl[state] * 2 ** (failures - 1))
+        self.entries[key] = {"state": state, "failures": failures, "until": time.monotonic() + ttl}
+        return ttl
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry and entry["until"] > time.monotonic():
+            return entry["state"]
+        return None
+
+    def clear(self, key: str):
+        self.entries.pop(key, None)
+
+# Estados de falha e TTL inicial de cada um (segundos)
+#   blocked: 403/429 ou desafio do Cloudflare
+#   unavailable: erro de rede ou 5xx
+#   not_found: 404 (página não existe)
+#   invalid: HTML recebido mas sem a estrutura esperada
+negative_cache = NegativeCache(
+    base_ttl={"blocked": 30, "unavailable": 15, "not_found": 300, "invalid": 60},
+    max_ttl=3600,
+)
+
+# Precedência ao resumir várias tentativas numa falha só (a mais informativa vence)
+FAILURE_PRECEDENCE = ["not_found", "blocked", "invalid", "unavailable"]
+
+def summarize_failures(failures: set) -> str:
+    """
+    Falha única para guardar no cache negativo. 404 de um proxy público ("proxy_not_found")
+    não prova que a página não existe: só conta como not_found se todas as tentativas
+    concordarem; senão vence o bloqueio/indisponibilidade das outras tentativas.
+    """
+    if failures == {"proxy_not_found"}:
+        return "not_found"
+    return next(state for state in FAILURE_PRECEDENCE if state in failures)
+
+# Marcas de página de desafio do Cloudflare
+CLOUDFLARE_CHALLENGE_MARKERS = ("just a moment", "cf-challenge", "challenge-platform", "cf-browser-verification")
+
+# Jobs em segundo plano (ex.: sitemap) usam chaves próprias ("background:<url>"): respeitam
+# o bloqueio do host registrado pelas requisições, mas nunca o criam nem o limpam
+def upstream_failure(url: str, background: bool = False) -> Optional[str]:
+    """Estado de falha em cache para a URL (ou para o host inteiro), se houver"""
+    from urllib.parse import urlparse
+    own = negative_cache.get(f"background:{url}" if background else f"url:{url}")
+    return negative_cache.get(f"host:{urlparse(url).netloc}") or own
+
+def record_upstream_failure(url: str, state: str, background: bool = False):
+    from urllib.parse import urlparse
+    if background:
+        ttl = negative_cache.record(f"background:{url}", state)
+    else:
+        ttl = negative_cache.record(f"url:{url}", state)
+        # Bloqueio/indisponibilidade afetam o site inteiro, não só esta página
+        if state in ("blocked", "unavailable"):
+            negative_cache.record(f"host:{urlparse(url).netloc}", state)
+    print(f"[CACHE] Falha '{state}' em cache por {ttl:.0f}s: {url}")
+
+def record_upstream_success(url: str, background: bool = False):
+    from urllib.parse import urlparse
+    if background:
+        negative_cache.clear(f"background:{url}")
+        return
+    negative_cache.clear(f"url:{url}")
+    negative_cache.clear(f"host:{urlparse(url).netloc}")
+
+def is_valid_page_html(html: str) -> bool:
+    """HTML mínimo de uma página do site (descarta erros e páginas de proxy)"""
+    return (
+        len(html) > 5000 and  # Deve ter pelo menos 5KB
+        'lermangas' in html.lower() and  # Deve ser do site certo
+        ('post-title' in html or 'wp-manga' in html or 'summary_image' in html)  # Estrutura WordPress
+    )
+
+class PageFetch(NamedTuple):
+    html: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    not_modified: bool = False  # upstream respondeu 304 ao GET condicional
+
 async def fetch_page(url: str) -> str:
     """Faz requisição HTTP assíncrona com retry, múltiplos proxies e delay anti-bot"""
-    cache_key = f"page_{url}"
-    if cache_key in cache:
-        return cache[cache_key]
+    return (await fetch_page_result(url)).html
+
+async def fetch_page_result(
+    url: str,
+    conditional: Optional[dict] = None,
+    validate=is_valid_page_html,
+    background: bool = False,
+) -> PageFetch:
+    """
+    Busca uma página pela cascata de proxies; `conditional` traz If-None-Match/If-Modified-Since.
+    `validate(texto)` decide se a resposta é o conteúdo esperado; `background` isola as falhas
+    de jobs em segundo plano do cache negativo do host.
+    """
+    conditional = conditional or {}
+    
+    # Falha recente em cache: responder na hora sem refazer a cascata de proxies
+    failure = upstream_failure(url, background)
+    if failure:
+        print(f"[CACHE] Falha em cache ({failure}): {url}")
+        return PageFetch("")
     
     import random
     from urllib.parse import quote
@@ -213,55 +1119,77 @@ async def fetch_page(url: str) -> str:
         proxy_list = [url]  # Sem proxy
     
     last_error = None
+    failures = set()
     
     # Tentar cada proxy
     for proxy_url in proxy_list:
         for attempt in range(2):  # 2 tentativas por proxy
+            if deadline_expired():
+                print(f"[WARN] Prazo esgotado buscando {url}")
+                return PageFetch("")
             try:
                 if attempt > 0:
-                    await asyncio.sleep(random.uniform(0.5, 1.5))
+                    await with_deadline(asyncio.sleep(random.uniform(0.5, 1.5)))
                 
                 # Não usar headers especiais com proxy
                 headers = {} if proxy_url != url else get_random_headers()
+                headers.update(conditional)
                 
                 async with httpx.AsyncClient(
                     headers=headers if headers else None, 
-                    timeout=30.0, 
+                    timeout=upstream_timeout(30.0), 
                     follow_redirects=True
                 ) as client:
-                    response = await client.get(proxy_url)
+                    with profile_span("upstream"):
+                        response = await with_deadline(client.get(proxy_url))
+                    
+                    # Página não mudou: quem chamou renova o que já tem em cache
+                    if response.status_code == 304 and conditional:
+                        print(f"[CACHE] 304 Not Modified: {url}")
+                        record_upstream_success(url, background)
+                        return PageFetch("", not_modified=True)
                     
                     # Verificar se resposta é válida
                     if response.status_code == 200:
-                        html = response.text
-                        
-                        # Validar HTML mínimo
-                        is_valid = (
-                            len(html) > 5000 and  # Deve ter pelo menos 5KB
-                            'lermangas' in html.lower() and  # Deve ser do site certo
-                            ('post-title' in html or 'wp-manga' in html or 'summary_image' in html)  # Estrutura WordPress
-                        )
+                        with profile_span("validate"):
+                            html = response.text
+                            is_valid = validate(html)
                         
                         if is_valid:
-                            cache[cache_key] = html
+                            record_upstream_success(url, background)
+                            if raw_html_cache is not None and not background and len(html) <= RAW_HTML_CACHE_BYTES:
+                                raw_html_cache[url] = html
                             print(f"[SUCCESS] Proxy worked: {proxy_url[:50]}... ({len(html)} chars)")
                             print(f"[DEBUG] HTML contains 'post-title': {'post-title' in html}")
                             print(f"[DEBUG] HTML contains 'summary_image': {'summary_image' in html}")
-                            return html
+                            return PageFetch(html, response.headers.get("ETag"), response.headers.get("Last-Modified"))
                         else:
                             print(f"[WARN] Proxy returned invalid HTML: {len(html)} chars, lermangas: {'lermangas' in html.lower()}")
                             print(f"[WARN] HTML preview: {html[:300]}")
+                            challenged = any(marker in html[:5000].lower() for marker in CLOUDFLARE_CHALLENGE_MARKERS)
+                            failures.add("blocked" if challenged else "invalid")
                             continue
                     
                     # Se 403/429, tentar próximo proxy
                     if response.status_code in [403, 429]:
                         print(f"[WARN] Proxy blocked: {response.status_code}")
+                        failures.add("blocked")
+                        break  # Próximo proxy
+                    
+                    # 404 não muda com retry (mas só o da origem é definitivo)
+                    if response.status_code == 404:
+                        print(f"[WARN] Page not found: {url}")
+                        failures.add("not_found" if proxy_url == url else "proxy_not_found")
                         break  # Próximo proxy
                     
                     response.raise_for_status()
                     
+            except DeadlineExceeded:
+                print(f"[WARN] Prazo esgotado buscando {url}")
+                return PageFetch("")
             except Exception as e:
                 last_error = e
+                failures.add("unavailable")
                 print(f"[ERROR] Proxy failed: {str(e)[:100]}")
                 continue
     
@@ -270,8 +1198,49 @@ async def fetch_page(url: str) -> str:
     print(f"[CRITICAL] All proxies failed for {url}. Last error: {str(last_error)[:200]}")
     print(f"[INFO] LerManga is behind Cloudflare Challenge - cannot be scraped from serverless")
     
+    # Guardar a falha para que as próximas requisições não repitam toda a cascata
+    if failures and not deadline_expired():
+        record_upstream_failure(url, summarize_failures(failures), background)
+    
     # Retornar HTML vazio em vez de erro 500 para não quebrar frontend
-    return ""  # Frontend vai mostrar "sem dados" em vez de erro
+    return PageFetch("")  # Frontend vai mostrar "sem dados" em vez de erro
+
+def is_empty_result(value) -> bool:
+    """Resultado que não vale guardar: nada extraído, listagem vazia ou capítulo sem imagens"""
+    if value is None or value == []:
+        return True
+    return isinstance(value, ChapterImages) and not value.images
+
+async def load_parsed_page(cache_key: str, url: str, parse, refresh: bool = False):
+    """
+    Resultado extraído de uma página do site, com cache do objeto pronto.
+    Hit custa uma consulta ao dicionário; depois de expirar, um 304 ao GET condicional
+    renova a entrada sem baixar nem reprocessar o HTML. Retorna None se a página falhar.
+    Com refresh=True ignora a entrada ainda válida e revalida no upstream.
+    """
+    if not refresh and cache_key in cache:
+        return materialize(cache[cache_key])
+    
+    # HTML bruto guardado (opcional) permite reprocessar sem ir ao upstream
+    raw_html = raw_html_cache.get(url) if raw_html_cache is not None and not refresh else None
+    if raw_html:
+        page = PageFetch(raw_html)
+    else:
+        page = await fetch_page_result(url, cache.conditional_headers(cache_key))
+        if page.not_modified:
+            value = cache.revalidate(cache_key)
+            if value is not None:
+                return materialize(value)
+            page = await fetch_page_result(url)  # entrada expirou durante a requisição
+    
+    if not page.html:
+        return None
+    
+    with profile_span("extract"):
+        value = parse(page.html)
+    if not is_empty_result(value):
+        cache.set(cache_key, compact(value), page.etag, page.last_modified)
+    return value
 
 async def get_manga_cover(slug: str) -> str:
     """Busca a imagem de capa real de um mangá fazendo scraping rápido"""
@@ -286,10 +1255,11 @@ async def get_manga_cover(slug: str) -> str:
         # Usar proxy AllOrigins
         proxied_url = get_proxied_url(manga_url)
         
-        async with httpx.AsyncClient(timeout=10.0, follow_redirects=True) as client:
-            response = await client.get(proxied_url)
+        async with httpx.AsyncClient(timeout=upstream_timeout(10.0), follow_redirects=True) as client:
+            with profile_span("upstream"):
+                response = await with_deadline(client.get(proxied_url))
             if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'lxml')
+                soup = make_soup(response.text)
                 
                 # Buscar imagem de capa
                 img_elem = soup.select_one(".summary_image img, .tab-summary img, .manga-cover img")
@@ -312,26 +1282,34 @@ async def root():
         "endpoints": {
             "/api/home": "Dados da home (populares, quentes, atualizações)",
             "/api/search?q={query}": "Buscar mangás por título",
+            "/api/search/federated?q={query}": "Busca combinada MangaDex + LerManga sem duplicados",
             "/api/manga/{slug}": "Detalhes de um mangá",
+            "/api/manga/batch?slugs=a,b,c": "Detalhes de vários mangás (parcial se o prazo esgotar)",
             "/api/manga/{slug}/chapter/{number}": "Imagens de um capítulo",
+            "/api/manga/{slug}/chapter/{number}/archive": "Capítulo inteiro em CBZ (streaming)",
             "/api/manga/list?page={n}": "Lista todos os mangás paginado",
             "/api/genres": "Lista todos os gêneros/tags disponíveis",
             "/api/genre/{slug}?page={n}": "Mangás filtrados por gênero",
-            "/api/filter?genres=acao,aventura&status=ongoing&order=popular": "Busca avançada com múltiplos filtros"
+            "/api/filter?genres=acao,aventura&status=ongoing&order=popular": "Busca avançada com múltiplos filtros",
+            "/api/mangadex/manga?title={query}": "Lista/busca no MangaDex (cache + capa expandida)",
+            "/api/mangadex/manga/{id}": "Detalhes de um mangá do MangaDex",
+            "/api/mangadex/manga/{id}/feed": "Capítulos de um mangá do MangaDex",
+            "/api/mangadex/tags": "Tags do MangaDex",
+            "/api/mangadex/at-home/{chapter_id}": "Servidor MangaDex@Home de um capítulo",
+            "/api/mangadex/chapter/{chapter_id}/archive": "Capítulo do MangaDex em CBZ (streaming)",
+            "/api/watch/stream?slugs=a,b&mangadex=id1": "Novos capítulos dos mangás assinados (SSE)",
+            "/api/sitemap/status": "Sincronização do cache pelo sitemap do site",
+            "/api/admin/profiles": "Perfis de requisições (header X-Admin-Token; ativar com X-Profile)",
+            "/api/admin/memory?compare=true": "Memória ocupada por namespace de cache (header X-Admin-Token)"
         }
     }
 
-@app.get("/api/home", response_model=HomeData)
-async def get_home():
-    """Retorna dados da página inicial"""
-    html = await fetch_page(BASE_URL)
-    
-    # Se HTML vazio (Cloudflare bloqueou), retornar vazio
-    if not html or len(html) < 10000:
-        print("[INFO] LerManga blocked - returning empty home data")
-        return HomeData()
+def parse_home(html: str) -> Optional[HomeData]:
+    """Extrai as seções da home (None se o HTML não for a home completa)"""
+    if len(html) < 10000:
+        return None
     
-    soup = BeautifulSoup(html, 'lxml')
+    soup = make_soup(html)
     
     result = HomeData()
     
@@ -370,6 +1348,18 @@ async def get_home():
     
     return result
 
+@app.get("/api/home", response_model=HomeData)
+async def get_home():
+    """Retorna dados da página inicial"""
+    home = await load_parsed_page("home", BASE_URL, parse_home)
+    
+    # Se não carregou (Cloudflare bloqueou ou prazo esgotou), retornar vazio
+    if home is None:
+        print("[INFO] LerManga blocked - returning empty home data")
+        return HomeData(partial=deadline_expired())
+    
+    return home
+
 @app.get("/api/search", response_model=List[MangaCard])
 async def search_manga(q: str = Query(..., min_length=1)):
     """Busca mangás com autocomplete dinâmico usando AJAX do WordPress"""
@@ -443,7 +1433,7 @@ async def search_manga(q: str = Query(..., min_length=1)):
                     
                     # Se retornou HTML em vez de JSON, parsear
                     elif response.text and '<' in response.text:
-                        soup = BeautifulSoup(response.text, 'lxml')
+                        soup = make_soup(response.text)
                         items = soup.select("a, .item, li")
                         
                         for item in items[:10]:
@@ -475,7 +1465,7 @@ async def search_manga(q: str = Query(..., min_length=1)):
     if not results:
         search_url = f"{BASE_URL}/?s={q}&post_type=wp-manga"
         html = await fetch_page(search_url)
-        soup = BeautifulSoup(html, 'lxml')
+        soup = make_soup(html)
         
         # Tentar estrutura de busca (.c-tabs-item)
         search_items = soup.select(".c-tabs-item")
@@ -528,12 +1518,38 @@ async def search_manga(q: str = Query(..., min_length=1)):
     
     return results
 
-@app.get("/api/manga/{slug}", response_model=MangaDetail)
-async def get_manga_detail(slug: str):
-    """Retorna detalhes de um mangá"""
-    url = f"{BASE_URL}/manga/{slug}/"
-    html = await fetch_page(url)
-    soup = BeautifulSoup(html, 'lxml')
+# Máximo de mangás por consulta em lote
+BATCH_MAX_SLUGS = 20
+
+# Tempo reservado no fim do prazo para montar e serializar a resposta parcial
+PARTIAL_RESPONSE_MARGIN = 0.5
+
+@app.get("/api/manga/batch", response_model=MangaBatch)
+async def get_manga_batch(slugs: str = Query(..., description="Slugs separados por vírgula")):
+    """Detalhes de vários mangás; os que não ficarem prontos no prazo ou falharem voltam em `missing`"""
+    slug_list = list(dict.fromkeys(s.strip() for s in slugs.split(",") if s.strip()))[:BATCH_MAX_SLUGS]
+    tasks = {asyncio.ensure_future(load_manga_detail(slug)): slug for slug in slug_list}
+    if not tasks:
+        return MangaBatch()
+
+    remaining = time_remaining()
+    timeout = None if remaining is None else max(0.0, remaining - PARTIAL_RESPONSE_MARGIN)
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+
+    result = MangaBatch()
+    for task in done:
+        # Falha no upstream (None) também vai para `missing`, não como placeholder
+        if task.exception() is None and task.result() is not None:
+            result.results[tasks[task]] = task.result()
+    result.missing = [slug for slug in slug_list if slug not in result.results]
+    result.partial = bool(result.missing)
+    return result
+
+def parse_manga_detail(html: str, slug: str) -> MangaDetail:
+    """Extrai os detalhes de um mangá da página dele"""
+    soup = make_soup(html)
     
     # DEBUG: Log HTML length and sample
     print(f"[DEBUG] HTML length for {slug}: {len(html)} chars")
@@ -670,12 +1686,20 @@ async def get_manga_detail(slug: str):
         chapters=chapters
     )
 
-@app.get("/api/manga/{slug}/chapter/{chapter_number}", response_model=ChapterImages)
-async def get_chapter_images(slug: str, chapter_number: str):
-    """Retorna as imagens de um capítulo"""
-    url = f"{BASE_URL}/manga/{slug}/capitulo-{chapter_number}/"
-    html = await fetch_page(url)
-    soup = BeautifulSoup(html, 'lxml')
+@app.get("/api/manga/{slug}", response_model=MangaDetail)
+async def get_manga_detail(slug: str):
+    """Retorna detalhes de um mangá"""
+    detail = await load_manga_detail(slug)
+    return detail or MangaDetail(title=slug, slug=slug, cover_image="")
+
+async def load_manga_detail(slug: str) -> Optional[MangaDetail]:
+    """Detalhes do mangá pelo cache/upstream; None quando a página não pôde ser carregada"""
+    url = f"{BASE_URL}/manga/{slug}/"
+    return await load_parsed_page(f"detail_{slug}", url, lambda html: parse_manga_detail(html, slug))
+
+def parse_chapter_images(html: str, slug: str, chapter_number: str) -> ChapterImages:
+    """Extrai as imagens e a navegação de um capítulo"""
+    soup = make_soup(html)
     
     # Título do mangá
     title_elem = soup.select_one(".breadcrumb li:nth-child(2) a")
@@ -716,16 +1740,35 @@ async def get_chapter_images(slug: str, chapter_number: str):
         next_chapter=next_chapter
     )
 
-@app.get("/api/manga/list", response_model=List[MangaCard])
-async def list_all_manga(page: int = Query(1, ge=1)):
-    """Lista todos os mangás com paginação"""
-    url = f"{BASE_URL}/manga/page/{page}/" if page > 1 else f"{BASE_URL}/manga/"
-    html = await fetch_page(url)
-    soup = BeautifulSoup(html, 'lxml')
+async def load_chapter_images(slug: str, chapter_number: str) -> ChapterImages:
+    """Imagens de um capítulo (cache de resultados extraídos)"""
+    url = f"{BASE_URL}/manga/{slug}/capitulo-{chapter_number}/"
+    chapter = await load_parsed_page(
+        f"chapter_{slug}_{chapter_number}", url,
+        lambda html: parse_chapter_images(html, slug, chapter_number),
+    )
+    return chapter or ChapterImages(manga_title=slug, chapter_number=chapter_number)
+
+@app.get("/api/manga/{slug}/chapter/{chapter_number}", response_model=ChapterImages)
+async def get_chapter_images(
+    slug: str,
+    chapter_number: str,
+    dimensions: bool = Query(False, description="Inclui largura/altura/tamanho/formato das páginas já medidas"),
+):
+    """Retorna as imagens de um capítulo"""
+    chapter = await load_chapter_images(slug, chapter_number)
+    if dimensions and chapter.images:
+        chapter.pages = cached_page_dimensions(chapter.images, LERMANGA_IMAGE_HEADERS)
+    return chapter
+
+def parse_manga_list(html: str) -> List[MangaCard]:
+    """Extrai os cards de uma página de listagem (todos, gênero, filtros, busca)"""
+    soup = make_soup(html)
     
     results = []
     # Corrigido: usar .page-item-detail que retorna todos os 20 mangás
-    items = soup.select(".page-item-detail")
+    # (a página de busca do tema lista os resultados como .c-tabs-item__content)
+    items = soup.select(".page-item-detail, .c-tabs-item__content")
     
     for item in items:
         card = extract_manga_card(item)
@@ -734,69 +1777,235 @@ async def list_all_manga(page: int = Query(1, ge=1)):
     
     return results
 
-@app.get("/api/proxy-image")
-async def proxy_image(url: str = Query(..., description="URL da imagem a ser carregada")):
-    """Proxy para carregar imagens com os headers corretos e evitar CORS/hotlinking"""
-    
-    # Verificar cache primeiro
+@app.get("/api/manga/list", response_model=List[MangaCard])
+async def list_all_manga(page: int = Query(1, ge=1)):
+    """Lista todos os mangás com paginação"""
+    url = f"{BASE_URL}/manga/page/{page}/" if page > 1 else f"{BASE_URL}/manga/"
+    return await load_parsed_page(f"list_page_{page}", url, parse_manga_list) or []
+
+# Headers específicos para imagens do site
+LERMANGA_IMAGE_HEADERS = {
+    "User-Agent": HEADERS["User-Agent"],
+    "Referer": BASE_URL + "/",
+    "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
+    "Accept-Language": "pt-BR,pt;q=0.9",
+}
+
+async def load_proxied_image(url: str) -> Tuple[dict, str]:
+    """Carrega uma imagem do cache ou do upstream. Retorna (dados, status do cache)"""
     cache_key = f"img_{url}"
     if cache_key in image_cache:
-        cached_data = image_cache[cache_key]
-        return Response(
-            content=cached_data['content'],
-            media_type=cached_data['content_type'],
-            headers={
-                "Cache-Control": "public, max-age=86400",
-                "Access-Control-Allow-Origin": "*",
-                "X-Cache": "HIT"
-            }
+        return image_cache[cache_key], "HIT"
+    
+    conditional = image_cache.conditional_headers(cache_key)
+    with profile_span("upstream"):
+        response = await with_deadline(
+            get_http_client().get(url, headers={**LERMANGA_IMAGE_HEADERS, **conditional}, timeout=upstream_timeout(15.0))
         )
     
+    # Imagem não mudou: renovar a entrada sem baixar de novo
+    if response.status_code == 304 and conditional:
+        cached_data = image_cache.revalidate(cache_key)
+        if cached_data is not None:
+            return cached_data, "REVALIDATED"
+    
+    response.raise_for_status()
+    
+    # Salvar no cache (com ETag/Last-Modified para revalidação)
+    cached_data = {
+        'content': response.content,
+        'content_type': response.headers.get("content-type", "image/jpeg")
+    }
+    image_cache.store_response(cache_key, cached_data, response)
+    return cached_data, "MISS"
+
+@app.get("/api/proxy-image")
+async def proxy_image(url: str = Query(..., description="URL da imagem a ser carregada")):
+    """Proxy para carregar imagens com os headers corretos e evitar CORS/hotlinking"""
     try:
-        # Headers específicos para imagens
-        image_headers = {
-            "User-Agent": HEADERS["User-Agent"],
-            "Referer": BASE_URL + "/",
-            "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
-            "Accept-Language": "pt-BR,pt;q=0.9",
-        }
-        
-        async with httpx.AsyncClient(timeout=15.0, follow_redirects=True) as client:
-            response = await client.get(url, headers=image_headers)
-            response.raise_for_status()
-            
-            # Detectar tipo de conteúdo
-            content_type = response.headers.get("content-type", "image/jpeg")
-            content = response.content
-            
-            # Salvar no cache
-            image_cache[cache_key] = {
-                'content': content,
-                'content_type': content_type
-            }
-            
-            return Response(
-                content=content,
-                media_type=content_type,
-                headers={
-                    "Cache-Control": "public, max-age=86400",
-                    "Access-Control-Allow-Origin": "*",
-                    "X-Cache": "MISS"
-                }
-            )
+        cached_data, cache_status = await load_proxied_image(url)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao carregar imagem: {str(e)}")
+    
+    return Response(
+        content=cached_data['content'],
+        media_type=cached_data['content_type'],
+        headers={
+            "Cache-Control": "public, max-age=86400",
+            "Access-Control-Allow-Origin": "*",
+            "X-Cache": cache_status
+        }
+    )
+
+# DIMENSÕES DAS PÁGINAS
+# Com ?dimensions=true o capítulo traz largura/altura/tamanho/formato das páginas, para o
+# leitor reservar o espaço antes de a imagem chegar. A resposta nunca espera: traz só o que
+# já está em cache e mede o resto em segundo plano (fica pronto para a próxima leitura).
+# Só os primeiros KB de cada imagem são lidos (Range), o bastante para o cabeçalho
+# JPEG/PNG/WebP/GIF; acertos e falhas ficam em cache por URL.
+
+IMAGE_HEADER_READS = (16 * 1024, 128 * 1024)  # a 2ª leitura só se o cabeçalho não coube (EXIF grande)
+IMAGE_DIMENSION_CONCURRENCY = 8
+IMAGE_DIMENSION_TIMEOUT = 5.0
+image_dimensions_cache = TTLCache(maxsize=20000, ttl=7 * 86400)
+image_dimension_failures = TTLCache(maxsize=20000, ttl=3600)  # não repetir leituras que falharam
+_dimensions_inflight = set()  # URLs sendo medidas em segundo plano
+
+# Marcadores SOF (início de quadro) do JPEG, que trazem as dimensões
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def parse_image_header(data: bytes) -> Optional[Tuple[str, int, int]]:
+    """(formato, largura, altura) a partir do início do arquivo, ou None se não der para saber"""
+    if data.startswith(b"\x89PNG\r\n\x1a\n") and len(data) >= 24:
+        width, height = struct.unpack(">II", data[16:24])
+        return "png", width, height
+
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        width, height = struct.unpack("<HH", data[6:10])
+        return "gif", width, height
+
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8 ":  # com perdas
+            width, height = struct.unpack("<HH", data[26:30])
+            return "webp", width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L":  # sem perdas
+            bits = int.from_bytes(data[21:25], "little")
+            return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":  # estendido (animação, alfa, EXIF)
+            return "webp", int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+        return None
+
+    if data[:2] == b"\xff\xd8":
+        i = 2
+        while i + 9 <= len(data):
+            if data[i] != 0xFF:
+                return None  # fluxo corrompido
+            marker = data[i + 1]
+            if marker == 0xFF:  # bytes de preenchimento
+                i += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # marcadores sem tamanho
+                i += 2
+                continue
+            if marker in JPEG_SOF_MARKERS:
+                height, width = struct.unpack(">HH", data[i + 5:i + 9])
+                return "jpeg", width, height
+            i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None
+
+def content_range_total(value: Optional[str]) -> Optional[int]:
+    """Tamanho total em "Content-Range: bytes 0-16383/482133" """
+    if value and "/" in value:
+        total = value.rsplit("/", 1)[1].strip()
+        if total.isdigit():
+            return int(total)
+    return None
+
+async def fetch_image_dimensions(url: str, headers: dict) -> PageDimensions:
+    """Dimensões de uma imagem lendo só o começo do arquivo"""
+    cached = image_dimensions_cache.get(url)
+    if cached is not None:
+        return cached
+    if url in image_dimension_failures:
+        return PageDimensions(url=url)
+
+    # Imagem inteira já guardada pelo proxy: não precisa ir ao upstream
+    proxied = image_cache.get(f"img_{url}")
+    if proxied is not None:
+        parsed, size = parse_image_header(proxied["content"]), len(proxied["content"])
+    else:
+        try:
+            parsed, size = await read_image_header(url, headers)
+        except Exception as e:
+            print(f"[WARN] Falha ao ler dimensões de {url[:80]}: {str(e)[:100]}")
+            parsed, size = None, None
+
+    dims = PageDimensions(url=url, bytes=size)
+    if parsed is not None:
+        dims.format, dims.width, dims.height = parsed
+        image_dimensions_cache[url] = dims
+    else:
+        image_dimension_failures[url] = True
+    return dims
+
+async def read_image_header(url: str, headers: dict) -> Tuple[Optional[Tuple[str, int, int]], Optional[int]]:
+    """Lê o começo da imagem com Range. Retorna ((formato, largura, altura) ou None, tamanho total)"""
+    parsed, size = None, None
+    client = get_http_client()
+    for limit in IMAGE_HEADER_READS:
+        data = bytearray()
+        with profile_span("upstream"):
+            async with client.stream(
+                "GET", url,
+                headers={**headers, "Range": f"bytes=0-{limit - 1}"},
+                timeout=IMAGE_DIMENSION_TIMEOUT,
+            ) as response:
+                if response.status_code not in (200, 206):
+                    break
+                if response.status_code == 206:
+                    size = content_range_total(response.headers.get("Content-Range"))
+                elif response.headers.get("Content-Length", "").isdigit():
+                    size = int(response.headers["Content-Length"])  # servidor ignorou o Range
+                async for chunk in response.aiter_bytes():
+                    data += chunk
+                    if len(data) >= limit:
+                        break
+        parsed = parse_image_header(bytes(data))
+        if parsed is not None or len(data) < limit:
+            break  # achou, ou o arquivo inteiro já foi lido
+    return parsed, size
+
+def cached_page_dimensions(urls: List[str], headers: dict) -> List[PageDimensions]:
+    """Dimensões já conhecidas (as demais vêm vazias e são medidas em segundo plano)"""
+    pages, missing = [], []
+    for url in urls:
+        dims = image_dimensions_cache.get(url)
+        if dims is None:
+            dims = PageDimensions(url=url)
+            if url not in image_dimension_failures and url not in _dimensions_inflight:
+                missing.append(url)
+        pages.append(dims)
+    if missing:
+        _dimensions_inflight.update(missing)
+        spawn_background(measure_page_dimensions(missing, headers))
+    return pages
+
+async def measure_page_dimensions(urls: List[str], headers: dict):
+    """Mede as páginas em paralelo, desacoplado da requisição que pediu"""
+    request_deadline.set(None)
+    request_profile.set(None)
+    semaphore = asyncio.Semaphore(IMAGE_DIMENSION_CONCURRENCY)
+
+    async def measure(url: str):
+        try:
+            async with semaphore:
+                await fetch_image_dimensions(url, headers)
+        finally:
+            _dimensions_inflight.discard(url)
+
+    await asyncio.gather(*(measure(url) for url in urls), return_exceptions=True)
 
 @app.get("/api/mangadex-proxy")
-async def mangadex_proxy(url: str = Query(..., description="URL da imagem do MangaDex")):
+async def mangadex_proxy(
+    url: str = Query(..., description="URL da imagem do MangaDex"),
+    quality: str = Query("auto", description="Páginas de capítulo: auto, data ou data-saver"),
+):
     """
     Proxy específico para imagens do MangaDex
     MangaDex exige:
     - User-Agent real (não pode ser spoofed)
     - SEM header Via (não permite proxies não-transparentes)
     - Imagens devem ser proxiadas (não hotlinked)
+    Páginas de capítulo (baseUrl/data/hash/arquivo) passam pela seleção de nó MangaDex@Home
     """
     
+    at_home_match = AT_HOME_URL_RE.match(url)
+    if at_home_match:
+        return await proxy_at_home_page(at_home_match, quality)
+    
     # Verificar cache primeiro
     cache_key = f"mdx_{url}"
     if cache_key in image_cache:
@@ -812,42 +2021,1410 @@ async def mangadex_proxy(url: str = Query(..., description="URL da imagem do Man
         )
     
     try:
-        # Headers conforme documentação do MangaDex
-        # https://api.mangadex.org/docs/2-limitations/
-        mangadex_headers = {
-            "User-Agent": "MangaVerso/1.0 (https://github.com/thierrysuceli/mangaverso)",
-            "Accept": "image/avif,image/webp,image/apng,image/*,*/*;q=0.8",
-            "Accept-Language": "pt-BR,pt;q=0.9,en;q=0.8",
-            "Referer": "https://mangadex.org/",
-            # NÃO incluir Via header - MangaDex bloqueia proxies não-transparentes
-        }
+        conditional = image_cache.conditional_headers(cache_key)
+        response = await with_deadline(get_http_client().get(
+            url, headers={**MANGADEX_IMAGE_HEADERS, **conditional}, timeout=upstream_timeout(20.0)
+        ))
         
-        async with httpx.AsyncClient(timeout=20.0, follow_redirects=True) as client:
-            response = await client.get(url, headers=mangadex_headers)
-            response.raise_for_status()
-            
-            # Detectar tipo de conteúdo
-            content_type = response.headers.get("content-type", "image/jpeg")
-            content = response.content
-            
-            # Salvar no cache (imagens MangaDex são imutáveis)
-            image_cache[cache_key] = {
-                'content': content,
-                'content_type': content_type
+        # Capa não mudou: renovar a entrada sem baixar de novo
+        if response.status_code == 304 and conditional:
+            cached_data = image_cache.revalidate(cache_key)
+            if cached_data is not None:
+                return Response(
+                    content=cached_data['content'],
+                    media_type=cached_data['content_type'],
+                    headers={
+                        "Cache-Control": "public, max-age=2592000, immutable",  # 30 dias
+                        "Access-Control-Allow-Origin": "*",
+                        "X-Cache": "REVALIDATED"
+                    }
+                )
+        
+        response.raise_for_status()
+        
+        # Detectar tipo de conteúdo
+        content_type = response.headers.get("content-type", "image/jpeg")
+        content = response.content
+        
+        # Salvar no cache (com ETag/Last-Modified para revalidação)
+        image_cache.store_response(cache_key, {
+            'content': content,
+            'content_type': content_type
+        }, response)
+        
+        return Response(
+            content=content,
+            media_type=content_type,
+            headers={
+                "Cache-Control": "public, max-age=2592000, immutable",  # 30 dias
+                "Access-Control-Allow-Origin": "*",
+                "X-Cache": "MISS"
             }
-            
-            return Response(
-                content=content,
-                media_type=content_type,
-                headers={
-                    "Cache-Control": "public, max-age=2592000, immutable",  # 30 dias
-                    "Access-Control-Allow-Origin": "*",
-                    "X-Cache": "MISS"
-                }
-            )
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao carregar imagem do MangaDex: {str(e)}")
 
+# GATEWAY DA API MANGADEX
+# O frontend chamava api.mangadex.org pelo corsproxy.io, sem cache e com cada
+# navegador repetindo as mesmas requisições. Aqui o backend faz as chamadas com
+# o cliente compartilhado, cache por tipo de recurso e respeitando o rate limit.
+
+# Limites documentados em https://api.mangadex.org/docs/2-limitations/
+# ~5 req/s por IP no geral e 40 req/min no /at-home/server
+mangadex_limiter = RateLimiter(rate=5.0, burst=5)
+mangadex_at_home_limiter = RateLimiter(rate=40 / 60, burst=10)
+
+# Caches por tipo de recurso (TTL de acordo com a frequência de mudança)
+MANGADEX_CACHE_TTL = {
+    "manga": 600,      # listas, buscas e detalhes: 10 minutos
+    "feed": 300,       # lista de capítulos: 5 minutos
+    "tags": 86400,     # tags quase nunca mudam: 24 horas
+    "at_home": 600,    # baseUrl do MangaDex@Home vale ~15 minutos
+}
+mangadex_caches = {
+    "manga": TTLCache(maxsize=500, ttl=MANGADEX_CACHE_TTL["manga"]),
+    "feed": TTLCache(maxsize=500, ttl=MANGADEX_CACHE_TTL["feed"]),
+    "tags": TTLCache(maxsize=4, ttl=MANGADEX_CACHE_TTL["tags"]),
+    "at_home": TTLCache(maxsize=500, ttl=MANGADEX_CACHE_TTL["at_home"]),
+}
+
+# Requisições em andamento (várias chamadas simultâneas à mesma URL compartilham a resposta)
+_mangadex_inflight: Dict[tuple, asyncio.Future] = {}
+
+# Parâmetros aceitos pela API do MangaDex que repassamos do frontend
+MANGADEX_ALLOWED_PARAMS = (
+    "title", "limit", "offset", "status[]", "includedTags[]", "excludedTags[]",
+    "includedTagsMode", "excludedTagsMode", "availableTranslatedLanguage[]",
+    "translatedLanguage[]", "originalLanguage[]", "contentRating[]",
+    "publicationDemographic[]", "ids[]", "order[", "includes[]", "hasAvailableChapters",
+)
+MANGADEX_DEFAULT_CONTENT_RATING = ["safe", "suggestive"]
+
+def build_mangadex_params(
+    request: Request,
+    includes: Tuple[str, ...] = ("cover_art",),
+    default_content_rating: bool = True,
+    max_limit: int = 100,
+) -> List[Tuple[str, str]]:
+    """Filtra e normaliza os parâmetros da query para a API do MangaDex"""
+    params = []
+    for key, value in request.query_params.multi_items():
+        if not key.startswith(MANGADEX_ALLOWED_PARAMS):
+            continue
+        if key == "limit":
+            try:
+                value = str(max(1, min(int(value), max_limit)))
+            except ValueError:
+                continue
+        params.append((key, value))
+
+    # Expandir relacionamentos (capa/autor chegam na mesma resposta)
+    for include in includes:
+        if ("includes[]", include) not in params:
+            params.append(("includes[]", include))
+
+    # Conteúdo adulto excluído por padrão
+    if default_content_rating and not any(k == "contentRating[]" for k, _ in params):
+        params.extend(("contentRating[]", rating) for rating in MANGADEX_DEFAULT_CONTENT_RATING)
+
+    # Ordenar para que a mesma consulta gere a mesma chave de cache
+    return sorted(params)
+
+def get_retry_after(response: httpx.Response) -> float:
+    """Calcula quanto esperar após um 429 do MangaDex"""
+    retry_at = response.headers.get("X-RateLimit-Retry-After")
+    if retry_at:
+        try:
+            return max(1.0, float(retry_at) - time.time())  # timestamp unix
+        except ValueError:
+            pass
+    try:
+        return max(1.0, float(response.headers.get("Retry-After", "1")))
+    except ValueError:
+        return 1.0
+
+async def _request_mangadex(path: str, params: List[Tuple[str, str]], limiter: RateLimiter) -> dict:
+    """Faz a requisição ao MangaDex respeitando o rate limit, com retry em 429/5xx"""
+    client = get_http_client()
+    headers = {"User-Agent": MANGADEX_USER_AGENT, "Accept": "application/json"}
+    last_error = None
+
+    for attempt in range(3):
+        await limiter.acquire()
+        try:
+            with profile_span("upstream"):
+                response = await client.get(f"{MANGADEX_API_BASE}{path}", params=params, headers=headers)
+        except httpx.HTTPError as e:
+            last_error = e
+            await asyncio.sleep(0.5 * (attempt + 1))
+            continue
+
+        if response.status_code == 429:
+            wait = get_retry_after(response)
+            print(f"[WARN] MangaDex rate limit atingido, aguardando {wait:.1f}s")
+            limiter.block_for(wait)
+            last_error = HTTPException(status_code=429, detail="MangaDex rate limit")
+            continue
+
+        if response.status_code >= 500:
+            last_error = HTTPException(status_code=502, detail=f"MangaDex retornou {response.status_code}")
+            await asyncio.sleep(0.5 * (attempt + 1))
+            continue
+
+        if response.status_code >= 400:
+            raise HTTPException(status_code=response.status_code, detail=f"MangaDex retornou {response.status_code}")
+
+        return response.json()
+
+    if isinstance(last_error, HTTPException):
+        raise last_error
+    raise HTTPException(status_code=502, detail=f"Erro ao acessar MangaDex: {str(last_error)}")
+
+async def fetch_mangadex_json(
+    resource: str,
+    path: str,
+    params: Optional[List[Tuple[str, str]]] = None,
+    limiter: RateLimiter = mangadex_limiter,
+) -> Tuple[dict, bool]:
+    """Busca JSON no MangaDex usando o cache do recurso. Retorna (dados, veio_do_cache)"""
+    params = params or []
+    resource_cache = mangadex_caches[resource]
+    cache_key = (path, tuple(params))
+    if cache_key in resource_cache:
+        return resource_cache[cache_key], True
+
+    inflight_key = (resource, cache_key)
+    if inflight_key in _mangadex_inflight:
+        return await with_deadline(asyncio.shield(_mangadex_inflight[inflight_key])), True
+
+    async def fetch_and_store():
+        # Roda desacoplado de quem pediu: se o cliente desistir, o resultado ainda vai para o cache
+        request_deadline.set(None)
+        try:
+            data = await _request_mangadex(path, params, limiter)
+            resource_cache[cache_key] = data
+            return data
+        finally:
+            _mangadex_inflight.pop(inflight_key, None)
+
+    future = asyncio.ensure_future(fetch_and_store())
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())  # evita "exception never retrieved"
+    _mangadex_inflight[inflight_key] = future
+    return await with_deadline(asyncio.shield(future)), False
+
+def mangadex_response(resource: str, data: dict, hit: bool) -> JSONResponse:
+    """Resposta JSON com headers de cache compatíveis com o TTL do recurso"""
+    return JSONResponse(
+        content=data,
+        headers={
+            "Cache-Control": f"public, max-age={MANGADEX_CACHE_TTL[resource]}",
+            "X-Cache": "HIT" if hit else "MISS",
+        },
+    )
+
+@app.get("/api/mangadex/manga")
+async def mangadex_manga_list(request: Request):
+    """Lista/busca mangás no MangaDex (mesmos parâmetros de GET /manga), com capa expandida"""
+    params = build_mangadex_params(request)
+    data, hit = await fetch_mangadex_json("manga", "/manga", params)
+    return mangadex_response("manga", data, hit)
+
+@app.get("/api/mangadex/manga/{manga_id}")
+async def mangadex_manga_detail(manga_id: str):
+    """Detalhes de um mangá do MangaDex com capa e autor expandidos"""
+    params = [("includes[]", "author"), ("includes[]", "cover_art")]
+    data, hit = await fetch_mangadex_json("manga", f"/manga/{manga_id}", params)
+    return mangadex_response("manga", data, hit)
+
+@app.get("/api/mangadex/manga/{manga_id}/feed")
+async def mangadex_manga_feed(manga_id: str, request: Request):
+    """Capítulos de um mangá do MangaDex (GET /manga/{id}/feed)"""
+    # Sem filtro de contentRating por padrão: o feed devolve os mesmos capítulos que o cliente antigo via
+    params = build_mangadex_params(request, includes=(), default_content_rating=False, max_limit=500)
+    data, hit = await fetch_mangadex_json("feed", f"/manga/{manga_id}/feed", params)
+    return mangadex_response("feed", data, hit)
+
+@app.get("/api/mangadex/tags")
+async def mangadex_tags():
+    """Lista de tags do MangaDex (compartilhada por todos os usuários)"""
+    data, hit = await fetch_mangadex_json("tags", "/manga/tag")
+    return mangadex_response("tags", data, hit)
+
+@app.get("/api/mangadex/at-home/{chapter_id}")
+async def mangadex_at_home(chapter_id: str):
+    """Servidor MangaDex@Home e arquivos das páginas de um capítulo"""
+    data, hit = await fetch_mangadex_json(
+        "at_home", f"/at-home/server/{chapter_id}", limiter=mangadex_at_home_limiter
+    )
+    remember_at_home_chapter(chapter_id, data)
+    return mangadex_response("at_home", data, hit)
+
+# SELEÇÃO DE NÓ MANGADEX@HOME
+# Páginas de capítulo vêm de nós voluntários com desempenho muito variável.
+# Medimos latência/erros por nó e, quando um nó está lento ou falhando,
+# tentamos um nó novo (via /at-home/server) e por fim uploads.mangadex.org.
+
+AT_HOME_URL_RE = re.compile(
+    r"^(?P<base>https?://[^?#]+?)/(?P<quality>data|data-saver)/(?P<hash>[0-9a-zA-Z]+)/(?P<filename>[^/?#]+)$"
+)
+
+# Tempo máximo por tentativa (um nó lento não deve travar a página inteira)
+AT_HOME_TIMEOUT = 8.0
+AT_HOME_CONNECT_TIMEOUT = 3.0
+
+# Acima destes limites o proxy passa a servir a versão data-saver (configurável por env)
+AT_HOME_DATA_SAVER_LATENCY = float(os.getenv("MANGADEX_DATA_SAVER_LATENCY", "2.5"))  # segundos
+AT_HOME_DATA_SAVER_MIN_KBPS = float(os.getenv("MANGADEX_DATA_SAVER_MIN_KBPS", "150"))  # KB/s
+
+# Nó é evitado após N falhas seguidas, durante o cooldown
+AT_HOME_MAX_ERRORS = 2
+AT_HOME_ERROR_COOLDOWN = 60
+
+# Intervalo mínimo entre pedidos de nó novo para o mesmo capítulo (limite de 40 req/min)
+AT_HOME_REFRESH_INTERVAL = 30
+
+# Relatório de desempenho pedido pela rede MangaDex@Home
+MANGADEX_REPORT_URL = "https://api.mangadex.network/report"
+
+class AtHomeNode:
+    """Desempenho observado de um nó MangaDex@Home (médias móveis exponenciais)"""
+
+    def __init__(self):
+        self.latency: Optional[float] = None  # segundos por imagem
+        self.bandwidth: Optional[float] = None  # bytes por segundo
+        self.errors = 0  # falhas consecutivas
+        self.last_error = 0.0
+
+    def record_success(self, elapsed: float, size: int):
+        # Imagens pequenas não servem para estimar banda (dominadas pela latência)
+        bandwidth = size / elapsed if elapsed > 0 and size >= 32 * 1024 else None
+        self.latency = elapsed if self.latency is None else 0.7 * self.latency + 0.3 * elapsed
+        if bandwidth is not None:
+            self.bandwidth = bandwidth if self.bandwidth is None else 0.7 * self.bandwidth + 0.3 * bandwidth
+        self.errors = 0
+
+    def record_error(self):
+        self.errors += 1
+        self.last_error = time.monotonic()
+
+    def is_healthy(self) -> bool:
+        return self.errors < AT_HOME_MAX_ERRORS or time.monotonic() - self.last_error > AT_HOME_ERROR_COOLDOWN
+
+    def is_slow(self) -> bool:
+        if self.latency is not None and self.latency > AT_HOME_DATA_SAVER_LATENCY:
+            return True
+        return self.bandwidth is not None and self.bandwidth < AT_HOME_DATA_SAVER_MIN_KBPS * 1024
+
+# Estatísticas por baseUrl e capítulos vistos pelo gateway (hash -> arquivos de cada qualidade)
+at_home_nodes = TTLCache(maxsize=256, ttl=3600)
+at_home_chapters = TTLCache(maxsize=2000, ttl=3600)
+
+def get_at_home_node(base_url: str) -> AtHomeNode:
+    node = at_home_nodes.get(base_url)
+    if node is None:
+        node = at_home_nodes[base_url] = AtHomeNode()
+    return node
+
+def remember_at_home_chapter(chapter_id: str, data: dict):
+    """Guarda a lista de arquivos do capítulo para permitir troca de nó/qualidade no proxy"""
+    chapter = data.get("chapter") or {}
+    if not chapter.get("hash"):
+        return
+    previous = at_home_chapters.get(chapter["hash"], {})
+    at_home_chapters[chapter["hash"]] = {
+        "chapter_id": chapter_id,
+        "base_url": data.get("baseUrl"),
+        "data": chapter.get("data", []),
+        "data_saver": chapter.get("dataSaver", []),
+        "refreshed_at": previous.get("refreshed_at", 0.0),
+    }
+
+def at_home_saver_filename(chapter_hash: str, filename: str) -> Optional[str]:
+    """Nome do arquivo data-saver equivalente a uma página em qualidade original"""
+    info = at_home_chapters.get(chapter_hash)
+    if not info:
+        return None
+    try:
+        return info["data_saver"][info["data"].index(filename)]
+    except (ValueError, IndexError):
+        return None
+
+async def fresh_at_home_node(chapter_hash: str) -> Optional[str]:
+    """Pede ao MangaDex um nó novo para o capítulo (se o conhecemos)"""
+    info = at_home_chapters.get(chapter_hash)
+    if not info:
+        return None
+    if time.monotonic() - info["refreshed_at"] < AT_HOME_REFRESH_INTERVAL:
+        return info["base_url"]
+
+    info["refreshed_at"] = time.monotonic()
+    path = f"/at-home/server/{info['chapter_id']}"
+    mangadex_caches["at_home"].pop((path, ()), None)
+    try:
+        data, _ = await fetch_mangadex_json("at_home", path, limiter=mangadex_at_home_limiter)
+    except HTTPException as e:
+        print(f"[WARN] Não foi possível obter nó MangaDex@Home novo: {e.detail}")
+        return None
+    remember_at_home_chapter(info["chapter_id"], data)
+    return data.get("baseUrl")
+
+async def _send_at_home_report(payload: dict):
+    try:
+        await get_http_client().post(MANGADEX_REPORT_URL, json=payload, timeout=5.0)
+    except httpx.HTTPError:
+        pass
+
+def report_at_home(node_base: str, url: str, success: bool, size: int, elapsed: float, cached: bool):
+    """Envia o relatório de sucesso/falha exigido pela rede MangaDex@Home (exceto uploads)"""
+    if node_base == MANGADEX_UPLOADS_BASE:
+        return
+    spawn_background(_send_at_home_report({
+        "url": url,
+        "success": success,
+        "bytes": size,
+        "duration": int(elapsed * 1000),
+        "cached": cached,
+    }))
+
+async def fetch_at_home_image(
+    base_url: str, quality: str, chapter_hash: str, filename: str, allow_data_saver: bool
+) -> Tuple[bytes, str, str, str, str]:
+    """Baixa uma página tentando nó pedido -> nó novo -> uploads. Retorna (conteúdo, tipo, nó, qualidade, arquivo)"""
+    client = get_http_client()
+    tried = set()
+
+    for stage in ("requested", "fresh", "uploads"):
+        if stage == "requested":
+            node_base = base_url if get_at_home_node(base_url).is_healthy() else None
+        elif stage == "fresh":
+            node_base = await fresh_at_home_node(chapter_hash)
+        else:
+            node_base = MANGADEX_UPLOADS_BASE
+        if not node_base or node_base in tried:
+            continue
+        if deadline_expired():
+            raise DeadlineExceeded()
+        tried.add(node_base)
+
+        node = get_at_home_node(node_base)
+        page_quality, page_file = quality, filename
+        if allow_data_saver and quality == "data" and node.is_slow():
+            saver_file = at_home_saver_filename(chapter_hash, filename)
+            if saver_file:
+                page_quality, page_file = "data-saver", saver_file
+
+        page_url = f"{node_base}/{page_quality}/{chapter_hash}/{page_file}"
+        start = time.monotonic()
+        try:
+            timeout = httpx.Timeout(upstream_timeout(AT_HOME_TIMEOUT), connect=upstream_timeout(AT_HOME_CONNECT_TIMEOUT))
+            with profile_span("upstream"):
+                response = await client.get(page_url, headers=MANGADEX_IMAGE_HEADERS, timeout=timeout)
+                response.raise_for_status()
+                content = response.content
+        except httpx.HTTPError as e:
+            elapsed = time.monotonic() - start
+            node.record_error()
+            report_at_home(node_base, page_url, False, 0, elapsed, False)
+            print(f"[WARN] Nó MangaDex@Home falhou ({node_base[:50]}): {str(e)[:100]}")
+            continue
+
+        elapsed = time.monotonic() - start
+        node.record_success(elapsed, len(content))
+        report_at_home(
+            node_base, page_url, True, len(content), elapsed,
+            response.headers.get("X-Cache", "").upper().startswith("HIT"),
+        )
+        content_type = response.headers.get("content-type", "image/jpeg")
+        return content, content_type, node_base, page_quality, page_file
+
+    raise HTTPException(status_code=502, detail="Nenhum nó MangaDex@Home disponível para a imagem")
+
+async def load_at_home_page(match: re.Match, quality: str) -> Tuple[dict, str, str, Optional[str]]:
+    """Carrega uma página do MangaDex@Home (cache ou nó). Retorna (dados, status do cache, qualidade, nó)"""
+    base_url, url_quality, chapter_hash, filename = match.group("base", "quality", "hash", "filename")
+
+    # Qualidade forçada pelo cliente (se conhecemos o arquivo equivalente)
+    if quality == "data-saver" and url_quality == "data":
+        saver_file = at_home_saver_filename(chapter_hash, filename)
+        if saver_file:
+            url_quality, filename = "data-saver", saver_file
+    allow_data_saver = quality == "auto"
+
+    # Cache independente do nó (a mesma página vem de qualquer nó)
+    cache_candidates = [(url_quality, filename)]
+    if allow_data_saver and url_quality == "data":
+        saver_file = at_home_saver_filename(chapter_hash, filename)
+        if saver_file:
+            cache_candidates.append(("data-saver", saver_file))
+    for cached_quality, cached_file in cache_candidates:
+        cached_data = image_cache.get(f"mdx_at_home_{cached_quality}_{chapter_hash}_{cached_file}")
+        if cached_data:
+            return cached_data, "HIT", cached_quality, None
+
+    content, content_type, node_base, served_quality, served_file = await fetch_at_home_image(
+        base_url, url_quality, chapter_hash, filename, allow_data_saver
+    )
+    cached_data = {
+        'content': content,
+        'content_type': content_type
+    }
+    image_cache[f"mdx_at_home_{served_quality}_{chapter_hash}_{served_file}"] = cached_data
+    return cached_data, "MISS", served_quality, node_base
+
+async def proxy_at_home_page(match: re.Match, quality: str) -> Response:
+    """Serve uma página de capítulo do MangaDex@Home escolhendo o nó e a qualidade"""
+    cached_data, cache_status, served_quality, node_base = await load_at_home_page(match, quality)
+    headers = {
+        "Cache-Control": "public, max-age=2592000, immutable",  # 30 dias
+        "Access-Control-Allow-Origin": "*",
+        "X-Cache": cache_status,
+        "X-Image-Quality": served_quality,
+    }
+    if node_base:
+        headers["X-MangaDex-Node"] = node_base
+    return Response(content=cached_data['content'], media_type=cached_data['content_type'], headers=headers)
+
+# ARQUIVOS CBZ DE CAPÍTULOS
+# Um único download em streaming substitui dezenas de requisições ao proxy de imagens.
+# As imagens são baixadas com janela limitada e escritas no ZIP na ordem das páginas,
+# sem montar o arquivo inteiro em memória.
+
+# Quantas páginas baixar ao mesmo tempo por arquivo
+ARCHIVE_WINDOW = 6
+
+# JPEG/PNG/WebP/GIF/AVIF já são comprimidos: guardar sem deflate
+ARCHIVE_IMAGE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+    "image/avif": ".avif",
+}
+
+class ZipStreamBuffer:
+    """Destino não-seekable para o zipfile: acumula bytes até serem enviados ao cliente"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def comic_info_xml(series: str, number: str, page_count: int, missing: Optional[List[int]] = None) -> str:
+    """Metadados ComicInfo.xml lidos pela maioria dos leitores de CBZ"""
+    # Série/número desconhecidos ficam de fora em vez de preenchidos com um identificador
+    series_xml = f"  <Series>{xml_escape(series)}</Series>\n" if series else ""
+    number_xml = f"  <Number>{xml_escape(number)}</Number>\n" if number else ""
+    notes = ""
+    if missing:
+        notes = f"  <Notes>Incompleto: páginas {', '.join(map(str, missing))} não puderam ser baixadas</Notes>\n"
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        "<ComicInfo>\n"
+        f"{series_xml}"
+        f"{number_xml}"
+        f"  <PageCount>{page_count}</PageCount>\n"
+        f"{notes}"
+        "  <LanguageISO>pt</LanguageISO>\n"
+        "</ComicInfo>\n"
+    )
+
+# Entrada extra no CBZ quando alguma página falhou (o ZIP já está em streaming, sem como mudar headers)
+ARCHIVE_MISSING_PAGES_FILE = "PAGINAS_FALTANDO.txt"
+
+async def stream_chapter_archive(image_urls: List[str], load_image, series: str, number: str):
+    """
+    Gera o CBZ em pedaços conforme as páginas chegam (load_image(url) -> dados do cache).
+    Página que falha é tentada mais uma vez; as que continuarem faltando são listadas no
+    ComicInfo.xml (gravado por último) e em PAGINAS_FALTANDO.txt. Sem nenhuma página, o
+    download é interrompido com erro.
+    """
+    buffer = ZipStreamBuffer()
+    archive = zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED)
+    date_time = time.localtime()[:6]
+    pages = iter(enumerate(image_urls, start=1))
+    pending = deque()
+
+    def fill_window():
+        while len(pending) < ARCHIVE_WINDOW:
+            try:
+                page_number, image_url = next(pages)
+            except StopIteration:
+                return
+            pending.append((page_number, asyncio.ensure_future(load_image(image_url))))
+
+    missing = []
+
+    try:
+        fill_window()
+        while pending:
+            page_number, task = pending.popleft()
+            fill_window()
+            try:
+                image = await task
+            except Exception as e:
+                print(f"[WARN] Página {page_number} falhou, tentando de novo: {str(e)[:100]}")
+                try:
+                    image = await load_image(image_urls[page_number - 1])
+                except Exception as e:
+                    print(f"[WARN] Página {page_number} fora do arquivo: {str(e)[:100]}")
+                    missing.append(page_number)
+                    continue
+
+            content_type = image['content_type'].split(";")[0].strip().lower()
+            extension = ARCHIVE_IMAGE_EXTENSIONS.get(content_type, ".jpg")
+            info = zipfile.ZipInfo(f"{page_number:03d}{extension}", date_time=date_time)
+            info.compress_type = zipfile.ZIP_STORED
+            archive.writestr(info, image['content'])
+            yield buffer.drain()
+
+        if len(missing) == len(image_urls):
+            raise RuntimeError("nenhuma página do capítulo pôde ser baixada")
+
+        if missing:
+            info = zipfile.ZipInfo(ARCHIVE_MISSING_PAGES_FILE, date_time=date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, "Páginas que não puderam ser baixadas:\n" + "".join(
+                f"{page_number:03d}: {image_urls[page_number - 1]}\n" for page_number in missing
+            ))
+
+        info = zipfile.ZipInfo("ComicInfo.xml", date_time=date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        archive.writestr(info, comic_info_xml(series, number, len(image_urls) - len(missing), missing))
+        archive.close()
+        yield buffer.drain()
+    finally:
+        # Cliente desconectou ou terminou: não continuar baixando
+        for _, task in pending:
+            task.cancel()
+
+def archive_response(chunks, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type="application/vnd.comicbook+zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Access-Control-Allow-Origin": "*",
+        },
+    )
+
+async def load_archive_image(url: str) -> dict:
+    cached_data, _ = await load_proxied_image(url)
+    return cached_data
+
+@app.get("/api/manga/{slug}/chapter/{chapter_number}/archive")
+async def get_chapter_archive(slug: str, chapter_number: str):
+    """Baixa um capítulo do LerManga inteiro como CBZ (streaming)"""
+    chapter = await load_chapter_images(slug, chapter_number)
+    if not chapter.images:
+        raise HTTPException(status_code=404, detail="Capítulo sem imagens disponíveis")
+
+    chunks = stream_chapter_archive(chapter.images, load_archive_image, chapter.manga_title, chapter_number)
+    return archive_response(chunks, f"{slug}-capitulo-{chapter_number}.cbz")
+
+async def mangadex_chapter_info(chapter_id: str) -> Tuple[str, str]:
+    """Título do mangá e número do capítulo para o ComicInfo.xml ("" quando não disponíveis)"""
+    try:
+        data, _ = await fetch_mangadex_json("feed", f"/chapter/{chapter_id}", [("includes[]", "manga")])
+    except Exception as e:
+        print(f"[WARN] Metadados do capítulo {chapter_id} indisponíveis: {str(e)[:100]}")
+        return "", ""
+
+    chapter = data.get("data") or {}
+    series = ""
+    for rel in chapter.get("relationships", []):
+        if rel.get("type") == "manga":
+            titles = rel.get("attributes", {}).get("title", {})
+            series = titles.get("en") or next(iter(titles.values()), "")
+            break
+    return series, chapter.get("attributes", {}).get("chapter") or ""
+
+@app.get("/api/mangadex/chapter/{chapter_id}/archive")
+async def get_mangadex_chapter_archive(
+    chapter_id: str,
+    quality: str = Query("data", description="data ou data-saver"),
+):
+    """Baixa um capítulo do MangaDex inteiro como CBZ (streaming)"""
+    data, _ = await fetch_mangadex_json(
+        "at_home", f"/at-home/server/{chapter_id}", limiter=mangadex_at_home_limiter
+    )
+    remember_at_home_chapter(chapter_id, data)
+
+    chapter = data.get("chapter") or {}
+    url_quality = "data-saver" if quality == "data-saver" else "data"
+    files = chapter.get("dataSaver" if url_quality == "data-saver" else "data", [])
+    if not files:
+        raise HTTPException(status_code=404, detail="Capítulo sem páginas disponíveis")
+    urls = [f"{data['baseUrl']}/{url_quality}/{chapter['hash']}/{filename}" for filename in files]
+
+    async def load_page(url: str) -> dict:
+        cached_data, _, _, _ = await load_at_home_page(AT_HOME_URL_RE.match(url), url_quality)
+        return cached_data
+
+    series, number = await mangadex_chapter_info(chapter_id)
+    chunks = stream_chapter_archive(urls, load_page, series, number)
+    return archive_response(chunks, f"mangadex-{chapter_id}.cbz")
+
+# BUSCA FEDERADA (MangaDex + LerManga)
+
+# Prazo máximo de cada fonte; quem não responder a tempo fica fora (resposta parcial)
+SEARCH_SOURCE_DEADLINES = {
+    "mangadex": 4.0,
+    "lermanga": 6.0,
+}
+
+# Resposta combinada por consulta normalizada (parciais ficam pouco tempo para serem refeitas logo)
+search_cache = TTLCache(maxsize=500, ttl=600)
+partial_search_cache = TTLCache(maxsize=500, ttl=30)
+
+def normalize_title(text: str) -> str:
+    """Normaliza título para comparação (sem acentos latinos, casefold, só letras/números de qualquer escrita)"""
+    chars: List[str] = []
+    for c in unicodedata.normalize("NFKD", text or ""):
+        # Só tira acentos de letras latinas; marcas como o dakuten japonês mudam a letra
+        if unicodedata.combining(c) and chars and chars[-1].isascii():
+            continue
+        chars.append(c)
+    text = unicodedata.normalize("NFC", "".join(chars))
+    text = re.sub(r"[\W_]+", " ", text.casefold())
+    return text.strip()
+
+def title_match_score(query: str, titles: List[str]) -> float:
+    """Pontua o quão bem a consulta bate com o melhor dos títulos (0 a 1)"""
+    if not query:
+        return 0.0
+    query_tokens = set(query.split())
+    best = 0.0
+    for title in titles:
+        if not title:
+            continue
+        if title == query:
+            return 1.0
+        if title.startswith(query):
+            best = max(best, 0.8)
+        elif query in title:
+            best = max(best, 0.7)
+        elif query_tokens:
+            overlap = len(query_tokens & set(title.split())) / len(query_tokens)
+            best = max(best, 0.6 * overlap)
+    return best
+
+def mangadex_search_results(data: dict) -> List[FederatedSearchResult]:
+    """Converte a resposta de /manga do MangaDex em resultados federados"""
+    results = []
+    for manga in data.get("data", []):
+        attributes = manga.get("attributes", {})
+        titles = attributes.get("title", {})
+        title = titles.get("en") or next(iter(titles.values()), "")
+        alt_titles = [t for alt in attributes.get("altTitles", []) for t in alt.values()]
+
+        cover_image = ""
+        for rel in manga.get("relationships", []):
+            if rel.get("type") == "cover_art" and rel.get("attributes", {}).get("fileName"):
+                file_name = rel["attributes"]["fileName"]
+                cover_image = f"{MANGADEX_UPLOADS_BASE}/covers/{manga['id']}/{file_name}.256.jpg"
+                break
+
+        description = attributes.get("description", {})
+        results.append(FederatedSearchResult(
+            title=title,
+            alt_titles=alt_titles,
+            cover_image=cover_image,
+            description=description.get("pt-br") or description.get("en"),
+            status=attributes.get("status"),
+            latest_chapter=attributes.get("lastChapter") or None,
+            sources=[SearchSource(
+                source="mangadex",
+                id=manga["id"],
+                url=f"https://mangadex.org/title/{manga['id']}",
+                cover_image=cover_image,
+            )],
+        ))
+    return results
+
+def lermanga_search_results(cards: List[MangaCard]) -> List[FederatedSearchResult]:
+    """Converte cards do LerManga em resultados federados"""
+    return [
+        FederatedSearchResult(
+            title=card.title,
+            cover_image=card.cover_image,
+            rating=card.rating,
+            latest_chapter=card.latest_chapter,
+            sources=[SearchSource(source="lermanga", id=card.slug, url=card.url, cover_image=card.cover_image)],
+        )
+        for card in cards
+    ]
+
+async def search_source_mangadex(q: str) -> List[FederatedSearchResult]:
+    params = sorted([
+        ("title", q),
+        ("limit", "20"),
+        ("includes[]", "cover_art"),
+        ("availableTranslatedLanguage[]", "pt-br"),
+        *[("contentRating[]", rating) for rating in MANGADEX_DEFAULT_CONTENT_RATING],
+    ])
+    data, _ = await fetch_mangadex_json("manga", "/manga", params)
+    return mangadex_search_results(data)
+
+async def search_source_lermanga(q: str) -> List[FederatedSearchResult]:
+    # Página de busca do WordPress pela cascata de proxies (o autocomplete AJAX fica atrás do Cloudflare)
+    from urllib.parse import quote_plus
+    url = f"{BASE_URL}/?s={quote_plus(q)}&post_type=wp-manga"
+    cards = await load_parsed_page(f"search_{normalize_title(q)}", url, parse_manga_list)
+    if cards is None:
+        raise RuntimeError("busca do LerManga indisponível")  # fonte aparece como "error"
+    return lermanga_search_results(cards)
+
+SEARCH_SOURCES = {
+    "mangadex": search_source_mangadex,
+    "lermanga": search_source_lermanga,
+}
+
+async def run_search_source(name: str, q: str) -> Tuple[str, str, List[FederatedSearchResult]]:
+    """Executa uma fonte respeitando seu prazo. Retorna (fonte, status, resultados)"""
+    try:
+        deadline = upstream_timeout(SEARCH_SOURCE_DEADLINES[name])
+        results = await asyncio.wait_for(SEARCH_SOURCES[name](q), timeout=deadline)
+        return name, "ok", results
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        print(f"[WARN] Busca federada: {name} excedeu o prazo")
+        return name, "timeout", []
+    except Exception as e:
+        print(f"[ERROR] Busca federada: {name} falhou: {str(e)[:100]}")
+        return name, "error", []
+
+def merge_search_results(query: str, per_source: List[List[FederatedSearchResult]]) -> List[FederatedSearchResult]:
+    """Junta resultados de várias fontes, removendo duplicados por título/títulos alternativos"""
+    merged: List[FederatedSearchResult] = []
+    index_by_title: Dict[str, FederatedSearchResult] = {}
+
+    for results in per_source:
+        for position, result in enumerate(results):
+            keys = {normalize_title(t) for t in [result.title, *result.alt_titles]} - {""}
+            existing = next((index_by_title[k] for k in keys if k in index_by_title), None)
+
+            if existing is None:
+                existing = result
+                existing.score = title_match_score(query, list(keys)) - position * 0.001
+                merged.append(existing)
+            else:
+                known = {(s.source, s.id) for s in existing.sources}
+                for source in result.sources:
+                    if (source.source, source.id) not in known:
+                        known.add((source.source, source.id))
+                        existing.sources.append(source)
+                existing.alt_titles.extend(
+                    t for t in [result.title, *result.alt_titles]
+                    if t != existing.title and t not in existing.alt_titles
+                )
+                existing.cover_image = existing.cover_image or result.cover_image
+                existing.description = existing.description or result.description
+                existing.rating = existing.rating or result.rating
+                existing.latest_chapter = existing.latest_chapter or result.latest_chapter
+                existing.score += 0.1  # disponível em mais de uma fonte
+
+            for key in keys:
+                index_by_title.setdefault(key, existing)
+
+    merged.sort(key=lambda r: r.score, reverse=True)
+    return merged
+
+@app.get("/api/search/federated", response_model=FederatedSearchResponse)
+async def federated_search(q: str = Query(..., min_length=1)):
+    """Busca no MangaDex e no LerManga em paralelo e retorna resultados combinados e sem duplicados"""
+    query = normalize_title(q)
+    if not query:
+        # Só pontuação/símbolos: nada a buscar (e não pode dividir a mesma entrada de cache)
+        return FederatedSearchResponse(query=q)
+    if query in search_cache:
+        return search_cache[query]
+    if query in partial_search_cache:
+        return partial_search_cache[query]
+
+    outcomes = await asyncio.gather(*[run_search_source(name, q) for name in SEARCH_SOURCES])
+
+    response = FederatedSearchResponse(
+        query=q,
+        results=merge_search_results(query, [results for _, _, results in outcomes]),
+        source_status={name: status for name, status, _ in outcomes},
+        partial=any(status != "ok" for _, status, _ in outcomes),
+    )
+
+    if response.partial:
+        partial_search_cache[query] = response
+    else:
+        search_cache[query] = response
+    return response
+
+# ACOMPANHAMENTO DE NOVOS CAPÍTULOS (SSE)
+# Em vez de cada usuário recarregar a página de detalhes, os clientes assinam os
+# mangás que seguem via Server-Sent Events e um único agendador consulta cada
+# série: mais assinantes ou atualizações frequentes = consultas mais frequentes;
+# séries paradas vão espaçando as consultas. Novos capítulos são detectados
+# comparando a lista de capítulos e enviados para os assinantes.
+# Depende de um processo de longa duração (uvicorn); em serverless a conexão
+# termina junto com a função.
+
+WATCH_MIN_INTERVAL = 120  # segundos
+WATCH_MAX_INTERVAL = 6 * 3600
+WATCH_IDLE_BACKOFF = 1.5  # multiplicador por consulta sem novidade
+WATCH_MAX_SERIES_PER_CLIENT = 50
+WATCH_CONCURRENCY = 4  # consultas simultâneas ao upstream
+WATCH_HEARTBEAT = 15  # segundos entre comentários de keep-alive no SSE
+
+class WatchedSeries:
+    """Estado de uma série acompanhada (fonte + id) e do seu agendamento"""
+
+    def __init__(self, source: str, series_id: str):
+        self.source = source
+        self.series_id = series_id
+        self.subscribers = set()  # filas dos clientes SSE
+        self.known_chapters: Optional[set] = None  # None até a primeira consulta
+        self.idle_polls = 0
+        self.update_gap: Optional[float] = None  # média do intervalo entre atualizações
+        self.last_update: Optional[float] = None
+        self.next_poll = time.monotonic()
+        self.last_poll: Optional[float] = None
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.source, self.series_id
+
+    def poll_interval(self) -> float:
+        """Intervalo até a próxima consulta, pela frequência de atualização e nº de assinantes"""
+        if self.update_gap is None:
+            interval = WATCH_MIN_INTERVAL
+        else:
+            interval = self.update_gap / 4
+        interval *= WATCH_IDLE_BACKOFF ** self.idle_polls
+        interval /= 1 + math.log2(max(1, len(self.subscribers)))
+        return max(WATCH_MIN_INTERVAL, min(WATCH_MAX_INTERVAL, interval))
+
+    def record_update(self):
+        now = time.monotonic()
+        if self.last_update is not None:
+            gap = now - self.last_update
+            self.update_gap = gap if self.update_gap is None else 0.7 * self.update_gap + 0.3 * gap
+        self.last_update = now
+        self.idle_polls = 0
+
+class UpdateWatcher:
+    """Agendador único de consultas (fila de prioridade por horário da próxima consulta)"""
+
+    def __init__(self):
+        self.series: Dict[Tuple[str, str], WatchedSeries] = {}
+        self.queue: List[Tuple[float, int, Tuple[str, str]]] = []  # (next_poll, seq, key)
+        self.seq = 0
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def schedule(self, series: WatchedSeries, delay: float):
+        series.next_poll = time.monotonic() + delay
+        self.seq += 1
+        heapq.heappush(self.queue, (series.next_poll, self.seq, series.key))
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def poke(self, key: Tuple[str, str]):
+        """Antecipa a consulta de uma série (ex.: o sitemap indicou mudança)"""
+        series = self.series.get(key)
+        if series is not None and series.next_poll != math.inf:
+            self.schedule(series, 0)
+
+    def subscribe(self, keys: List[Tuple[str, str]], queue: asyncio.Queue):
+        for key in keys:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = WatchedSeries(*key)
+                self.schedule(series, 0)
+            series.subscribers.add(queue)
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = spawn_background(self.run())
+
+    def unsubscribe(self, keys: List[Tuple[str, str]], queue: asyncio.Queue):
+        for key in keys:
+            series = self.series.get(key)
+            if series is None:
+                continue
+            series.subscribers.discard(queue)
+            if not series.subscribers:
+                del self.series[key]
+        if self.wakeup is not None:
+            self.wakeup.set()  # permite encerrar o laço quando não sobra nenhuma série
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(WATCH_CONCURRENCY)
+        while self.series:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            next_poll, _, key = self.queue[0]
+            series = self.series.get(key)
+            if series is None or next_poll != series.next_poll:
+                heapq.heappop(self.queue)  # entrada antiga (série removida ou reagendada)
+                continue
+
+            wait = next_poll - time.monotonic()
+            if wait > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self.queue)
+            series.next_poll = math.inf  # em andamento; reagendada ao terminar
+            spawn_background(self.poll(series, semaphore))
+
+    async def poll(self, series: WatchedSeries, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                title, chapters = await fetch_series_chapters(series.source, series.series_id)
+            except Exception as e:
+                print(f"[WARN] Falha ao consultar {series.source}/{series.series_id}: {str(e)[:100]}")
+                title, chapters = None, None
+        series.last_poll = time.monotonic()
+
+        if chapters is not None:
+            current = {chapter["id"] for chapter in chapters}
+            if series.known_chapters is None:
+                series.known_chapters = current  # primeira consulta: só registra
+            else:
+                new_chapters = [chapter for chapter in chapters if chapter["id"] not in series.known_chapters]
+                series.known_chapters |= current
+                if new_chapters:
+                    series.record_update()
+                    self.publish(series, {
+                        "source": series.source,
+                        "id": series.series_id,
+                        "title": title,
+                        "chapters": new_chapters,
+                    })
+                else:
+                    series.idle_polls += 1
+        else:
+            series.idle_polls += 1
+
+        if series.key in self.series:
+            self.schedule(series, series.poll_interval())
+
+    def publish(self, series: WatchedSeries, event: dict):
+        print(f"[INFO] {len(event['chapters'])} capítulo(s) novo(s) em {series.source}/{series.series_id}")
+        for queue in list(series.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass  # cliente lento: descarta (ele recarrega a lista ao reconectar)
+
+watcher = UpdateWatcher()
+
+async def fetch_series_chapters(source: str, series_id: str) -> Tuple[Optional[str], Optional[List[dict]]]:
+    """Lista atual de capítulos de uma série. Retorna (título, capítulos) ou (None, None) se falhar"""
+    if source == "mangadex":
+        path = f"/manga/{series_id}/feed"
+        params = sorted([
+            ("translatedLanguage[]", "pt-br"),
+            ("order[readableAt]", "desc"),
+            ("limit", "50"),
+        ])
+        mangadex_caches["feed"].pop((path, tuple(params)), None)  # sempre a versão atual
+        data, _ = await fetch_mangadex_json("feed", path, params)
+        return None, [
+            {
+                "id": chapter["id"],
+                "number": chapter.get("attributes", {}).get("chapter"),
+                "title": chapter.get("attributes", {}).get("title"),
+            }
+            for chapter in data.get("data", [])
+        ]
+
+    url = f"{BASE_URL}/manga/{series_id}/"
+    detail = await load_parsed_page(
+        f"detail_{series_id}", url, lambda html: parse_manga_detail(html, series_id), refresh=True
+    )
+    if detail is None:
+        return None, None
+    return detail.title, [
+        {"id": chapter.url or chapter.number, "number": chapter.number, "title": chapter.title, "url": chapter.url}
+        for chapter in detail.chapters
+    ]
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/api/watch/stream")
+async def watch_stream(
+    slugs: Optional[str] = Query(None, description="Slugs do LerManga separados por vírgula"),
+    mangadex: Optional[str] = Query(None, description="IDs do MangaDex separados por vírgula"),
+):
+    """Server-Sent Events com os novos capítulos dos mangás assinados"""
+    keys = [("lermanga", s.strip()) for s in (slugs or "").split(",") if s.strip()]
+    keys += [("mangadex", m.strip()) for m in (mangadex or "").split(",") if m.strip()]
+    keys = list(dict.fromkeys(keys))[:WATCH_MAX_SERIES_PER_CLIENT]
+    if not keys:
+        raise HTTPException(status_code=400, detail="Informe ao menos um slug ou ID do MangaDex")
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+    watcher.subscribe(keys, queue)
+
+    async def events():
+        try:
+            yield "retry: 10000\n\n"  # intervalo de reconexão do EventSource
+            yield sse_event("subscribed", [{"source": source, "id": series_id} for source, series_id in keys])
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=WATCH_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield sse_event("new_chapters", event)
+        finally:
+            watcher.unsubscribe(keys, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/watch/status")
+async def watch_status():
+    """Séries acompanhadas e agendamento das consultas"""
+    now = time.monotonic()
+    return [
+        {
+            "source": series.source,
+            "id": series.series_id,
+            "subscribers": len(series.subscribers),
+            "known_chapters": len(series.known_chapters or ()),
+            "idle_polls": series.idle_polls,
+            "next_poll_in": None if series.next_poll == math.inf else round(max(0.0, series.next_poll - now), 1),
+        }
+        for series in sorted(watcher.series.values(), key=lambda s: s.next_poll)
+    ]
+
+# SINCRONIZAÇÃO PELO SITEMAP
+# O site (WordPress/Madara) publica sitemaps com `lastmod` por mangá e por capítulo.
+# Um job periódico lê o índice, baixa só os sitemaps alterados desde a última
+# sincronização e compara cada `lastmod` com o momento em que a entrada foi para o
+# cache: o que mudou é renovado (detalhes já em cache, via GET condicional) ou
+# apenas expirado. Com isso detalhes e capítulos podem ter TTL longo; se o sitemap
+# ficar inacessível, novas entradas voltam ao TTL curto.
+
+SITEMAP_INDEX_URL = os.getenv("LERMANGAS_SITEMAP_URL", f"{BASE_URL}/sitemap_index.xml")
+SITEMAP_SYNC_ENABLED = os.getenv("SITEMAP_SYNC", "true").lower() == "true"
+SITEMAP_SYNC_INTERVAL = int(os.getenv("SITEMAP_SYNC_INTERVAL", "300"))
+SITEMAP_CLOCK_SKEW = 120  # folga (s) entre o relógio do site e o nosso
+SITEMAP_MAX_REFRESH = 20  # renovações proativas por sincronização; o resto só expira
+SITEMAP_PAGE_RE = re.compile(r"^/manga/([^/]+)/(?:capitulo-([^/]+)/)?$")
+PROCESS_STARTED_AT = time.time()
+
+def parse_lastmod(value: Optional[str]) -> Optional[float]:
+    """Converte o lastmod (W3C datetime) em epoch; sem fuso = UTC"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def parse_sitemap(xml: str) -> Tuple[List[Tuple[str, Optional[float]]], List[Tuple[str, Optional[float]]]]:
+    """Extrai (sub-sitemaps, urls) de um sitemap, cada item como (loc, lastmod)"""
+    root = ElementTree.fromstring(xml)
+    sitemaps, urls = [], []
+    for element in root:
+        tag = element.tag.rsplit("}", 1)[-1]
+        if tag not in ("sitemap", "url"):
+            continue
+        loc = lastmod = None
+        for child in element:
+            child_tag = child.tag.rsplit("}", 1)[-1]
+            if child_tag == "loc":
+                loc = (child.text or "").strip()
+            elif child_tag == "lastmod":
+                lastmod = parse_lastmod(child.text)
+        if loc:
+            (sitemaps if tag == "sitemap" else urls).append((loc, lastmod))
+    return sitemaps, urls
+
+def is_valid_sitemap(text: str) -> bool:
+    return "<urlset" in text or "<sitemapindex" in text
+
+def sitemap_cache_keys(url: str) -> Optional[Tuple[str, Optional[str]]]:
+    """URL do site -> (slug, capítulo) quando for página de mangá ou capítulo"""
+    if not url.startswith(BASE_URL):
+        return None
+    match = SITEMAP_PAGE_RE.match(url[len(BASE_URL):])
+    return (match.group(1), match.group(2)) if match else None
+
+class SitemapSync:
+    """Job periódico de invalidação do cache guiado pelo sitemap"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.last_success: Optional[float] = None  # time.monotonic()
+        self.last_synced_at: Optional[float] = None  # epoch da última sincronização completa
+        self.sitemap_lastmod: Dict[str, Optional[float]] = {}
+        self.stats = {"runs": 0, "failures": 0, "sitemaps_read": 0, "expired": 0, "refreshed": 0}
+
+    def healthy(self) -> bool:
+        return self.last_success is not None and time.monotonic() - self.last_success < 3 * SITEMAP_SYNC_INTERVAL
+
+    def start(self):
+        if SITEMAP_SYNC_ENABLED and (self.task is None or self.task.done()):
+            self.task = spawn_background(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                self.stats["failures"] += 1
+                print(f"[WARN] Falha ao sincronizar sitemap: {str(e)[:100]}")
+            await asyncio.sleep(SITEMAP_SYNC_INTERVAL)
+
+    async def fetch(self, url: str) -> Optional[str]:
+        # Mesma cascata de proxies das páginas (o site fica atrás do Cloudflare), com falhas
+        # registradas só para o job: um sitemap bloqueado não bloqueia as páginas
+        page = await fetch_page_result(url, validate=is_valid_sitemap, background=True)
+        return page.html or None
+
+    async def sync(self):
+        self.stats["runs"] += 1
+        started_at = time.time()
+        index = await self.fetch(SITEMAP_INDEX_URL)
+        if index is None:
+            self.stats["failures"] += 1
+            return
+
+        sitemaps, urls = parse_sitemap(index)
+        # Só conta como sucesso (e libera o TTL longo) se cada sitemap de mangás/capítulos
+        # foi lido ou estava inalterado; sitemap bloqueado = mudanças que não veríamos
+        complete = True
+        if not sitemaps:  # o próprio endereço já é uma lista de URLs
+            sitemaps = [(SITEMAP_INDEX_URL, None)]
+            pending_urls = urls
+        else:
+            pending_urls = []
+            relevant = 0
+            for loc, lastmod in sitemaps:
+                name = loc.rsplit("/", 1)[-1].lower()
+                if "manga" not in name and "chapter" not in name and "capitulo" not in name:
+                    continue
+                relevant += 1
+                # Sitemap sem mudanças desde a última sincronização não precisa ser lido
+                if lastmod is not None and self.sitemap_lastmod.get(loc) == lastmod:
+                    continue
+                if lastmod is not None and self.last_synced_at is None and lastmod < PROCESS_STARTED_AT:
+                    self.sitemap_lastmod[loc] = lastmod  # anterior a qualquer entrada em cache
+                    continue
+                xml = await self.fetch(loc)
+                if xml is None:
+                    complete = False  # tenta de novo na próxima sincronização
+                    continue
+                self.stats["sitemaps_read"] += 1
+                pending_urls.extend(parse_sitemap(xml)[1])
+                self.sitemap_lastmod[loc] = lastmod
+            if not relevant:
+                print("[WARN] Índice do sitemap sem sitemaps de mangás; mantendo o TTL curto")
+                complete = False
+
+        await self.apply(pending_urls)
+        self.last_synced_at = started_at
+        if complete:
+            self.last_success = time.monotonic()
+        else:
+            self.stats["failures"] += 1
+
+    async def apply(self, urls: List[Tuple[str, Optional[float]]]):
+        """Expira/renova as entradas em cache mais antigas que o lastmod do sitemap"""
+        refresh, expired = {}, set()
+        for url, lastmod in urls:
+            keys = sitemap_cache_keys(url)
+            if keys is None or lastmod is None:
+                continue
+            slug, chapter_number = keys
+            changed = []
+            if chapter_number is None:
+                changed.append(f"detail_{slug}")
+            else:
+                changed.append(f"chapter_{slug}_{chapter_number}")
+                changed.append(f"detail_{slug}")  # capítulo novo/alterado muda a lista do mangá
+            for key in changed:
+                updated_at = cache.updated_at(key)
+                if updated_at is None or lastmod <= updated_at - SITEMAP_CLOCK_SKEW:
+                    continue
+                if key in refresh or key in expired:
+                    continue
+                if key.startswith("detail_") and key in cache and len(refresh) < SITEMAP_MAX_REFRESH:
+                    refresh[key] = slug
+                else:
+                    cache.expire(key)
+                    expired.add(key)
+        self.stats["expired"] += len(expired)
+
+        semaphore = asyncio.Semaphore(4)
+
+        async def refresh_detail(key: str, slug: str):
+            async with semaphore:
+                detail = await load_parsed_page(
+                    key, f"{BASE_URL}/manga/{slug}/", lambda html: parse_manga_detail(html, slug), refresh=True
+                )
+            if detail is None:
+                cache.expire(key)
+            self.stats["refreshed"] += 1
+            watcher.poke(("lermanga", slug))
+
+        if refresh:
+            print(f"[INFO] Sitemap: renovando {len(refresh)} mangá(s) alterado(s)")
+            await asyncio.gather(*(refresh_detail(key, slug) for key, slug in refresh.items()))
+
+sitemap_sync = SitemapSync()
+
+@app.on_event("startup")
+async def start_sitemap_sync():
+    sitemap_sync.start()
+
+@app.get("/api/sitemap/status")
+async def sitemap_status():
+    """Estado da sincronização do cache pelo sitemap"""
+    return {
+        "enabled": SITEMAP_SYNC_ENABLED,
+        "healthy": sitemap_sync.healthy(),
+        "page_ttl": SITEMAP_PAGE_TTL if sitemap_sync.healthy() else CACHE_TTL,
+        "last_success_ago": None if sitemap_sync.last_success is None else round(time.monotonic() - sitemap_sync.last_success, 1),
+        "sitemaps": len(sitemap_sync.sitemap_lastmod),
+        **sitemap_sync.stats,
+    }
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Perfilamento desativado (defina ADMIN_TOKEN)")
+    if not is_admin(request.headers.get("X-Admin-Token")):
+        raise HTTPException(status_code=403, detail="Token de administrador inválido")
+
+def find_profile(profile_id: int) -> RequestProfile:
+    for profile in profiles:
+        if profile.id == profile_id:
+            return profile
+    raise HTTPException(status_code=404, detail="Perfil não encontrado (já saiu do buffer?)")
+
+@app.get("/api/admin/profiles")
+async def list_profiles(request: Request, path: Optional[str] = Query(None, description="Filtra pelo início do caminho")):
+    """Perfis recentes (mais novos primeiro) com o tempo próprio de cada etapa"""
+    require_admin(request)
+    return [profile.summary() for profile in reversed(profiles) if not path or profile.path.startswith(path)]
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def get_profile(request: Request, profile_id: int):
+    """Perfil completo, com a linha do tempo das etapas"""
+    require_admin(request)
+    profile = find_profile(profile_id)
+    return {
+        **profile.summary(),
+        "spans": [
+            {"name": name, "start_ms": round(start * 1000, 2), "duration_ms": round(duration * 1000, 2)}
+            for name, start, duration in profile.spans
+        ],
+    }
+
+@app.get("/api/admin/profiles/{profile_id}/flamegraph")
+async def get_profile_flamegraph(request: Request, profile_id: int):
+    """Amostras da pilha em formato folded (entrada do flamegraph.pl ou do speedscope)"""
+    require_admin(request)
+    profile = find_profile(profile_id)
+    if profile.stacks is None:
+        raise HTTPException(status_code=404, detail='Perfil sem amostras de pilha (use "X-Profile: flamegraph")')
+    folded = "\n".join(f"{stack} {count}" for stack, count in sorted(profile.stacks.items()))
+    return PlainTextResponse(folded + "\n")
+
+def deep_sizeof(value, seen: set) -> int:
+    """Tamanho aproximado (bytes) de um objeto e de tudo que ele referencia, sem contar duas vezes"""
+    if id(value) in seen or value is None or isinstance(value, (bool, type)):
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, int, float, array)):
+        return size
+    if isinstance(value, dict):
+        return size + sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset, deque)):
+        return size + sum(deep_sizeof(item, seen) for item in value)
+    if hasattr(value, "__dict__"):
+        size += deep_sizeof(vars(value), seen)
+    for cls in type(value).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            if hasattr(value, slot):
+                size += deep_sizeof(getattr(value, slot), seen)
+    if isinstance(value, BaseModel):
+        size += deep_sizeof(value.__pydantic_fields_set__, seen)
+    return size
+
+def cache_namespace(key) -> str:
+    return key.split("_", 1)[0] if isinstance(key, str) else type(key).__name__
+
+@app.get("/api/admin/memory")
+async def memory_report(
+    request: Request,
+    compare: bool = Query(False, description="Também mede o tamanho equivalente em modelos Pydantic"),
+):
+    """Bytes ocupados por namespace de cache (entradas válidas + guardadas para revalidação)"""
+    require_admin(request)
+    report: Dict[str, dict] = {}
+    seen_by_namespace: Dict[str, set] = {}
+
+    def add(namespace: str, key, value, stale: bool = False, count: bool = True):
+        entry = report.setdefault(namespace, {"entries": 0, "stale_entries": 0, "bytes": 0})
+        if count:
+            entry["stale_entries" if stale else "entries"] += 1
+        seen = seen_by_namespace.setdefault(namespace, set())
+        entry["bytes"] += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+        if compare and not stale and isinstance(value, COMPACT_TYPES):
+            models = materialize(value)
+            entry["model_bytes"] = entry.get("model_bytes", 0) + deep_sizeof(models, set())
+
+    for key, value in list(cache.fresh.items()):
+        add(f"page:{cache_namespace(key)}", key, value)
+    for key, validated in list(cache.stale.items()):
+        # O valor é o mesmo objeto da entrada válida; aqui só somam os validadores
+        only_stale = key not in cache.fresh
+        add(f"page:{cache_namespace(key)}", key, validated, stale=True, count=only_stale)
+    for key, value in list(image_cache.fresh.items()):
+        add("images", key, value)
+    for key, validated in list(image_cache.stale.items()):
+        add("images", key, validated, stale=True, count=key not in image_cache.fresh)
+    if raw_html_cache is not None:
+        for key, value in list(raw_html_cache.items()):
+            add("raw_html", key, value)
+    for resource, resource_cache in mangadex_caches.items():
+        for key, value in list(resource_cache.items()):
+            add(f"mangadex:{resource}", key, value)
+    for name, search in (("search", search_cache), ("search_partial", partial_search_cache)):
+        for key, value in list(search.items()):
+            add(name, key, value)
+
+    total = sum(entry["bytes"] for entry in report.values())
+    return {"total_bytes": total, "namespaces": dict(sorted(report.items(), key=lambda item: -item[1]["bytes"]))}
+
 @app.get("/api/genres", response_model=List[Genre])
 async def get_genres():
     """Retorna lista de todos os gêneros/tags disponíveis"""
@@ -866,7 +3443,7 @@ async def get_genres():
         # Buscar página com filtros avançados
         search_url = f"{BASE_URL}/?s=&post_type=wp-manga"
         html = await fetch_page(search_url)
-        soup = BeautifulSoup(html, 'lxml')
+        soup = make_soup(html)
         
         # Extrair checkboxes de gêneros
         genres_inputs = soup.select('#search-advanced .form-group.checkbox-group input[name="genre[]"]')
@@ -893,10 +3470,6 @@ async def get_manga_by_genre(
     page: int = Query(1, ge=1, description="Número da página")
 ):
     """Retorna mangás filtrados por gênero/tag"""
-    cache_key = f"genre_{genre_slug}_page_{page}"
-    if cache_key in cache:
-        return cache[cache_key]
-    
     try:
         # URL padrão do WordPress Madara para gêneros
         if page == 1:
@@ -904,22 +3477,11 @@ async def get_manga_by_genre(
         else:
             genre_url = f"{BASE_URL}/manga-genre/{genre_slug}/page/{page}/"
         
-        html = await fetch_page(genre_url)
-        soup = BeautifulSoup(html, 'lxml')
-        
-        # Extrair cards de mangás - CORRIGIDO para pegar todos os 20 itens
-        manga_items = soup.select('.page-item-detail')
-        results = []
-        
-        for item in manga_items:
-            card = extract_manga_card(item)
-            if card:
-                results.append(card)
-        
-        # Cachear resultado
-        cache[cache_key] = results
-        return results
+        # Resultado extraído fica em cache (falhas não são cacheadas aqui)
+        return await load_parsed_page(f"genre_{genre_slug}_page_{page}", genre_url, parse_manga_list) or []
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar mangás do gênero: {str(e)}")
 
@@ -934,7 +3496,7 @@ async def filter_manga(
     
     cache_key = f"filter_{genres}_{status}_{order}_page_{page}"
     if cache_key in cache:
-        return cache[cache_key]
+        return materialize(cache[cache_key])
     
     try:
         # OTIMIZAÇÃO: Se tem apenas 1 gênero e sem outros filtros, redirecionar para endpoint de gênero
@@ -968,11 +3530,12 @@ async def filter_manga(
         if order and order != "latest":
             params['m_orderby'] = order
         
-        async with httpx.AsyncClient(headers=HEADERS, timeout=30.0) as client:
-            response = await client.get(search_url, params=params if params else None)
+        async with httpx.AsyncClient(headers=HEADERS, timeout=upstream_timeout(30.0)) as client:
+            with profile_span("upstream"):
+                response = await with_deadline(client.get(search_url, params=params if params else None))
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.text, 'lxml')
+            soup = make_soup(response.text)
             manga_items = soup.select('.page-item-detail')
             
             results = []
@@ -981,9 +3544,11 @@ async def filter_manga(
                 if card:
                     results.append(card)
             
-            cache[cache_key] = results
+            cache[cache_key] = compact(results)
             return results
             
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao filtrar mangás: {str(e)}")
 
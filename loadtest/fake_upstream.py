@@ -0,0 +1,319 @@
+"""
+Upstream simulado do LerMangas (tema WordPress Madara) para testes de carga offline.
+
+Serve páginas HTML com a mesma estrutura do site real (home, listagem, gêneros,
+detalhes e capítulos) e imagens, com latência configurável e injeção de falhas
+(403/429 e página de desafio do Cloudflare). Páginas gravadas do site real podem
+substituir as geradas colocando-as em --fixtures (ver README).
+
+Uso:
+    python loadtest/fake_upstream.py --port 9100 --latency-ms 80 --rate-429 0.02
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+from collections import Counter
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, Response
+from starlette.routing import Route
+
+GENRES = ["acao", "aventura", "comedia", "drama", "fantasia", "romance", "isekai", "shounen"]
+BADGES = ["Manhwa", "Manga", "Manhua", "Webtoon"]
+
+CHALLENGE_HTML = """<!DOCTYPE html><html lang="en-US"><head><title>Just a moment...</title>
+<meta http-equiv="refresh" content="35"></head><body><div id="cf-wrapper">
+<h1>Checking if the site connection is secure</h1>
+<p>lermangas.me needs to review the security of your connection before proceeding.</p>
+<div id="challenge-stage"></div></div></body></html>"""
+
+# Dimensões das páginas simuladas (lidas pelo ?dimensions=true da API)
+IMAGE_WIDTH, IMAGE_HEIGHT = 800, 1200
+
+# JPEG mínimo (SOI + APP0/JFIF + SOF0 com largura/altura) usado como cabeçalho das imagens simuladas
+JPEG_HEADER = (
+    bytes.fromhex("ffd8ffe000104a46494600010100000100010000")
+    + bytes.fromhex("ffc0001108") + IMAGE_HEIGHT.to_bytes(2, "big") + IMAGE_WIDTH.to_bytes(2, "big")
+    + bytes.fromhex("03012200021101031101")
+)
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)$")
+
+
+class UpstreamConfig:
+    def __init__(
+        self,
+        latency_ms: float = 50.0,
+        jitter_ms: float = 20.0,
+        rate_403: float = 0.0,
+        rate_429: float = 0.0,
+        challenge_rate: float = 0.0,
+        catalog_size: int = 200,
+        chapters_per_manga: int = 80,
+        pages_per_chapter: int = 30,
+        image_kb: int = 150,
+        fixtures_dir: str = "",
+        seed: int = 42,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_403 = rate_403
+        self.rate_429 = rate_429
+        self.challenge_rate = challenge_rate
+        self.catalog_size = catalog_size
+        self.chapters_per_manga = chapters_per_manga
+        self.pages_per_chapter = pages_per_chapter
+        self.image_kb = image_kb
+        self.fixtures_dir = fixtures_dir
+        self.seed = seed
+
+
+def manga_slug(index: int) -> str:
+    return f"manga-simulado-{index:04d}"
+
+
+def page_shell(base_url: str, title: str, body: str, body_class: str = "home") -> str:
+    """Estrutura comum das páginas do tema Madara (cabeçalho, menu e rodapé)"""
+    menu = "".join(f'<li><a href="{base_url}/manga-genre/{g}/">{g.title()}</a></li>' for g in GENRES)
+    return f"""<!DOCTYPE html>
+<html lang="pt-BR"><head><meta charset="UTF-8"><title>{title} - LerMangas</title>
+<link rel="stylesheet" href="{base_url}/wp-content/themes/madara/style.css">
+<link rel="canonical" href="{base_url}/"></head>
+<body class="{body_class} wp-manga-template-default">
+<div class="wrap"><div class="body-wrap"><header class="site-header">
+<div class="main-navigation"><div class="container"><div class="wrap_branding">
+<a class="logo" href="{base_url}/" title="LerMangas"><img src="{base_url}/wp-content/uploads/logo.png" alt="LerMangas"></a>
+</div><ul class="main-menu">{menu}</ul></div></div></header>
+<div class="site-content">{body}</div>
+<footer class="site-footer"><div class="copyright">&copy; lermangas.me - Todos os direitos reservados</div>
+<div class="nav-footer"><ul><li><a href="{base_url}/termos/">Termos</a></li><li><a href="{base_url}/dmca/">DMCA</a></li></ul></div>
+</footer></div></div></body></html>"""
+
+
+def manga_card(base_url: str, index: int, rng: random.Random) -> str:
+    slug = manga_slug(index)
+    badges = "".join(f'<a href="#">{b}</a>' for b in rng.sample(BADGES, 1))
+    return f"""<div class="page-item-detail manga">
+<div class="item-thumb hover-details c-image-hover">
+<a href="{base_url}/manga/{slug}/" title="Mangá Simulado {index}">
+<img width="175" height="238" data-src="{base_url}/wp-content/uploads/capas/{slug}.jpg" src="{base_url}/wp-content/uploads/loading.gif" class="img-responsive" alt="Mangá Simulado {index}"></a></div>
+<div class="item-summary"><div class="post-title font-title"><h3 class="h5">
+<span class="manga-title-badges">{badges}</span>
+<a href="{base_url}/manga/{slug}/">Mangá Simulado {index}</a></h3></div>
+<div class="meta-item rating"><div class="post-total-rating"><span class="score font-meta total_votes">{rng.uniform(3, 5):.1f}</span></div></div>
+<div class="list-chapter"><div class="chapter-item"><span class="chapter font-meta">
+<a href="{base_url}/manga/{slug}/capitulo-{rng.randint(1, 200)}/" class="btn-link chapter-link">Capítulo {rng.randint(1, 200)}</a></span>
+<span class="post-on font-meta">há 2 horas</span></div></div></div></div>"""
+
+
+def listing_html(base_url: str, config: UpstreamConfig, page: int, key: str) -> str:
+    rng = random.Random(f"{config.seed}-{key}-{page}")
+    indexes = [rng.randrange(config.catalog_size) for _ in range(20)]
+    cards = "".join(manga_card(base_url, i, rng) for i in indexes)
+    return page_shell(
+        base_url,
+        f"Mangás {key} página {page}",
+        f'<div class="c-page-content"><div class="page-content-listing item-big_thumbnail">{cards}</div>'
+        f'<div class="wp-pagenavi"><a class="nextpostslink" href="#">Próxima</a></div></div>',
+        body_class="archive wp-manga",
+    )
+
+
+def home_html(base_url: str, config: UpstreamConfig) -> str:
+    rng = random.Random(f"{config.seed}-home")
+
+    def section(css_class: str, count: int) -> str:
+        cards = "".join(manga_card(base_url, rng.randrange(config.catalog_size), rng) for _ in range(count))
+        return f'<div class="{css_class}"><div class="c-blog__heading"><h2>{css_class}</h2></div>{cards}</div>'
+
+    body = (
+        section("popular-manga-section", 12)
+        + section("trending-manga-section", 12)
+        + section("page-content-listing", 20)
+    )
+    return page_shell(base_url, "Início", body)
+
+
+def detail_html(base_url: str, config: UpstreamConfig, slug: str) -> str:
+    rng = random.Random(f"{config.seed}-{slug}")
+    number = slug.rsplit("-", 1)[-1]
+    genres = "".join(f'<a href="{base_url}/manga-genre/{g}/" rel="tag">{g.title()}</a>' for g in rng.sample(GENRES, 3))
+    chapters = "".join(
+        f'<li class="wp-manga-chapter"><a href="{base_url}/manga/{slug}/capitulo-{n}/">Capítulo {n}</a>'
+        f'<span class="chapter-release-date"><i>{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024</i></span></li>'
+        for n in range(config.chapters_per_manga, 0, -1)
+    )
+    body = f"""<div class="profile-manga summary-layout-1"><div class="container">
+<div class="post-title"><h1>Mangá Simulado {number}</h1></div>
+<div class="tab-summary"><div class="summary_image"><a href="{base_url}/manga/{slug}/">
+<img data-src="{base_url}/wp-content/uploads/capas/{slug}.jpg" class="img-responsive" alt="capa"></a></div>
+<div class="summary_content_wrap"><div class="summary_content"><div class="post-content">
+<div class="post-rating"><span class="score font-meta total_votes">{rng.uniform(3, 5):.1f}</span></div>
+<div class="post-content_item"><div class="summary-heading"><h5>Autor(es)</h5></div><div class="summary-content"><div class="author-content"><a href="#">Autor {number}</a></div></div></div>
+<div class="post-content_item"><div class="summary-heading"><h5>Artista(s)</h5></div><div class="summary-content"><div class="artist-content"><a href="#">Artista {number}</a></div></div></div>
+<div class="post-content_item"><div class="summary-heading"><h5>Gênero(s)</h5></div><div class="summary-content"><div class="genres-content">{genres}</div></div></div>
+<div class="post-content_item"><div class="summary-heading"><h5>Status</h5></div><div class="summary-content">Em andamento</div></div>
+</div></div></div></div></div></div>
+<div class="c-page-content style-1"><div class="description-summary"><div class="summary__content show-more">
+<p>Sinopse simulada do mangá {number}. {"Lorem ipsum dolor sit amet. " * 20}</p></div></div>
+<div class="page-content-listing single-page"><div class="listing-chapters_wrap"><ul class="main version-chap">{chapters}</ul></div></div></div>"""
+    return page_shell(base_url, f"Mangá Simulado {number}", body, body_class="wp-manga-template-default single-wp-manga")
+
+
+def chapter_html(base_url: str, config: UpstreamConfig, slug: str, chapter: int) -> str:
+    images = "".join(
+        f'<div class="page-break no-gaps"><img id="image-{i}" data-src="{base_url}/wp-content/uploads/WP-manga/data/{slug}/{chapter}/{i:03d}.jpg" '
+        f'src="{base_url}/wp-content/uploads/loading.gif" class="wp-manga-chapter-img"></div>'
+        for i in range(config.pages_per_chapter)
+    )
+    options = "".join(
+        f'<option value="{base_url}/manga/{slug}/capitulo-{n}/"{" selected" if n == chapter else ""}>Capítulo {n}</option>'
+        for n in range(1, config.chapters_per_manga + 1)
+    )
+    body = f"""<div class="c-breadcrumb"><ol class="breadcrumb"><li><a href="{base_url}/">Início</a></li>
+<li><a href="{base_url}/manga/{slug}/">Mangá Simulado {slug.rsplit("-", 1)[-1]}</a></li><li class="active">Capítulo {chapter}</li></ol></div>
+<div class="entry-header"><div class="select-pagination"><select class="selectpicker single-chapter-select">{options}</select></div></div>
+<div class="reading-content">{images}</div>"""
+    return page_shell(base_url, f"{slug} capítulo {chapter}", body, body_class="wp-manga-template-default single-wp-manga reading-manga")
+
+
+def create_upstream(config: UpstreamConfig) -> Starlette:
+    """Cria o app ASGI do upstream simulado"""
+    stats = Counter()
+    rng = random.Random(config.seed)
+    image_blob = JPEG_HEADER + bytes(max(0, config.image_kb * 1024 - len(JPEG_HEADER) - 2)) + b"\xff\xd9"
+
+    def recorded_fixture(path: str):
+        """HTML gravado do site real, se existir (ex.: manga/solo-leveling.html)"""
+        if not config.fixtures_dir:
+            return None
+        name = path.strip("/").replace("/", "__") or "home"
+        fixture = os.path.join(config.fixtures_dir, f"{name}.html")
+        if os.path.exists(fixture):
+            with open(fixture, encoding="utf-8") as f:
+                return f.read()
+        return None
+
+    async def simulate(request: Request):
+        """Latência e falhas injetadas (aplicadas a todas as rotas exceto /__stats)"""
+        delay = max(0.0, config.latency_ms + rng.uniform(-config.jitter_ms, config.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+        roll = rng.random()
+        if roll < config.rate_403:
+            stats["injected_403"] += 1
+            return HTMLResponse(CHALLENGE_HTML, status_code=403)
+        roll -= config.rate_403
+        if roll < config.rate_429:
+            stats["injected_429"] += 1
+            return Response("Too Many Requests", status_code=429, headers={"Retry-After": "1"})
+        roll -= config.rate_429
+        if roll < config.challenge_rate:
+            stats["injected_challenge"] += 1
+            return HTMLResponse(CHALLENGE_HTML, status_code=200)
+        return None
+
+    async def page(request: Request):
+        path = request.url.path
+        stats["requests"] += 1
+        kind = "image" if path.startswith("/wp-content/") else "html"
+        stats[f"requests_{kind}"] += 1
+
+        failure = await simulate(request)
+        if failure is not None:
+            return failure
+
+        if kind == "image":
+            headers = {"ETag": '"simulado-v1"'}
+            # Leitura parcial (Range) como a do CDN real, usada para medir as páginas
+            match = RANGE_RE.match(request.headers.get("range", ""))
+            if match and int(match.group(1)) < len(image_blob):
+                start = int(match.group(1))
+                end = min(int(match.group(2) or len(image_blob) - 1), len(image_blob) - 1)
+                body = image_blob[start:end + 1]
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(image_blob)}"
+                stats["image_bytes"] += len(body)
+                return Response(body, status_code=206, media_type="image/jpeg", headers=headers)
+            stats["image_bytes"] += len(image_blob)
+            return Response(image_blob, media_type="image/jpeg", headers=headers)
+
+        base_url = str(request.base_url).rstrip("/")
+        html = recorded_fixture(path)
+        if html is None:
+            html = render(base_url, path)
+        if html is None:
+            return HTMLResponse(page_shell(base_url, "Não encontrado", "<h1>404</h1>"), status_code=404)
+        return HTMLResponse(html)
+
+    def render(base_url: str, path: str):
+        if path == "/":
+            return home_html(base_url, config)
+        match = re.fullmatch(r"/page/(\d+)/", path)
+        if match:
+            return listing_html(base_url, config, int(match.group(1)), "home")
+        match = re.fullmatch(r"/manga/(?:page/(\d+)/)?", path)
+        if match:
+            return listing_html(base_url, config, int(match.group(1) or 1), "all")
+        match = re.fullmatch(r"/manga-genre/([^/]+)/(?:page/(\d+)/)?", path)
+        if match:
+            return listing_html(base_url, config, int(match.group(2) or 1), match.group(1))
+        match = re.fullmatch(r"/manga/([^/]+)/capitulo-(\d+)/", path)
+        if match:
+            return chapter_html(base_url, config, match.group(1), int(match.group(2)))
+        match = re.fullmatch(r"/manga/([^/]+)/", path)
+        if match:
+            return detail_html(base_url, config, match.group(1))
+        return None
+
+    async def get_stats(request: Request):
+        return JSONResponse(dict(stats))
+
+    async def reset_stats(request: Request):
+        stats.clear()
+        return JSONResponse({"ok": True})
+
+    return Starlette(routes=[
+        Route("/__stats", get_stats),
+        Route("/__reset", reset_stats, methods=["POST"]),
+        Route("/{path:path}", page),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upstream simulado do LerMangas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--rate-403", type=float, default=0.0, help="Fração de respostas 403 (bloqueio)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fração de respostas 429 (rate limit)")
+    parser.add_argument("--challenge-rate", type=float, default=0.0, help="Fração de páginas de desafio do Cloudflare")
+    parser.add_argument("--catalog-size", type=int, default=200)
+    parser.add_argument("--chapters-per-manga", type=int, default=80)
+    parser.add_argument("--pages-per-chapter", type=int, default=30)
+    parser.add_argument("--image-kb", type=int, default=150)
+    parser.add_argument("--fixtures", default="", help="Diretório com HTML gravado do site real")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = UpstreamConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_403=args.rate_403,
+        rate_429=args.rate_429,
+        challenge_rate=args.challenge_rate,
+        catalog_size=args.catalog_size,
+        chapters_per_manga=args.chapters_per_manga,
+        pages_per_chapter=args.pages_per_chapter,
+        image_kb=args.image_kb,
+        fixtures_dir=args.fixtures,
+        seed=args.seed,
+    )
+    uvicorn.run(create_upstream(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Teste de carga ponta a ponta da API (api/index.py) contra o upstream simulado.
+
+Sobe o upstream simulado (fake_upstream.py) e a API com uvicorn, gera tráfego
+com um mix realista de leitores (home, detalhes, capítulo + imagens, filtros)
+e grava um relatório JSON por commit com vazão, latências p50/p95/p99,
+requisições ao upstream e memória por worker. Roda totalmente offline.
+
+Uso:
+    python loadtest/run.py --duration 60 --concurrency 50 --workers 2
+    python loadtest/run.py --rate-429 0.05 --challenge-rate 0.02
+    python loadtest/run.py --compare loadtest/reports/<commit-anterior>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Peso de cada cenário no tráfego gerado
+DEFAULT_MIX = {
+    "home": 0.15,
+    "detail": 0.30,
+    "chapter": 0.35,
+    "filter": 0.20,
+}
+
+GENRES = ["acao", "aventura", "comedia", "drama", "fantasia", "romance", "isekai", "shounen"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def percentile(values, fraction: float) -> float:
+    """Percentil por posição (nearest-rank) de uma lista já ordenada"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def process_rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def worker_pids(master_pid: int):
+    """PIDs dos workers do uvicorn (filhos do processo principal, ou ele mesmo com 1 worker)"""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master_pid:
+            children.append(int(entry))
+    # Com vários workers o uvicorn também cria um processo auxiliar do multiprocessing (pequeno)
+    return [pid for pid in children if process_rss_mb(pid) > 20] or [master_pid]
+
+
+async def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url, timeout=1.0)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Servidor não respondeu em {timeout}s: {url}")
+
+
+class LoadTest:
+    def __init__(self, api_url: str, args):
+        self.api_url = api_url
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.samples = defaultdict(list)  # tipo de requisição -> latências (s)
+        self.errors = defaultdict(lambda: defaultdict(int))  # tipo -> status -> contagem
+        self.scenarios = defaultdict(int)
+        self.page_dimensions = defaultdict(int)  # páginas de capítulo devolvidas com/sem dimensões
+        # Popularidade tipo Zipf: poucos mangás concentram a maior parte das leituras
+        self.popularity = [1 / (i + 1) ** args.zipf for i in range(args.catalog_size)]
+
+    def pick_slug(self) -> str:
+        index = self.rng.choices(range(self.args.catalog_size), weights=self.popularity)[0]
+        return f"manga-simulado-{index:04d}"
+
+    async def request(self, client: httpx.AsyncClient, kind: str, path: str, params=None):
+        start = time.perf_counter()
+        try:
+            response = await client.get(self.api_url + path, params=params)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        self.samples[kind].append(time.perf_counter() - start)
+        if status != 200:
+            self.errors[kind][str(status)] += 1
+        return response
+
+    async def scenario_home(self, client):
+        await self.request(client, "home", "/api/home")
+
+    async def scenario_detail(self, client):
+        await self.request(client, "detail", f"/api/manga/{self.pick_slug()}")
+
+    async def scenario_filter(self, client):
+        if self.rng.random() < 0.5:
+            genre = self.rng.choice(GENRES)
+            await self.request(client, "genre", f"/api/genre/{genre}", {"page": self.rng.randint(1, 3)})
+        else:
+            genres = ",".join(self.rng.sample(GENRES, 2))
+            await self.request(client, "filter", "/api/filter", {"genres": genres, "page": self.rng.randint(1, 3)})
+
+    async def scenario_chapter(self, client):
+        slug = self.pick_slug()
+        chapter = self.rng.randint(1, self.args.chapters_per_manga)
+        # Como o leitor do frontend: dimensões já medidas vêm junto, as demais são medidas depois
+        response = await self.request(
+            client, "chapter", f"/api/manga/{slug}/chapter/{chapter}", {"dimensions": "true"}
+        )
+        if response is None or response.status_code != 200:
+            return
+        data = response.json()
+        for page in data.get("pages") or []:
+            self.page_dimensions["with" if page.get("width") else "without"] += 1
+        images = data.get("images", [])[: self.args.images_per_chapter]
+
+        # Navegador carrega as páginas com poucas conexões em paralelo
+        semaphore = asyncio.Semaphore(self.args.image_parallelism)
+
+        async def load(url):
+            async with semaphore:
+                await self.request(client, "image", "/api/proxy-image", {"url": url})
+
+        await asyncio.gather(*(load(url) for url in images))
+
+    async def virtual_user(self, client, deadline: float):
+        scenarios = list(DEFAULT_MIX)
+        weights = [DEFAULT_MIX[s] for s in scenarios]
+        while time.monotonic() < deadline:
+            scenario = self.rng.choices(scenarios, weights=weights)[0]
+            self.scenarios[scenario] += 1
+            await getattr(self, f"scenario_{scenario}")(client)
+            if self.args.think_ms:
+                await asyncio.sleep(self.rng.uniform(0, self.args.think_ms) / 1000)
+
+    async def run(self) -> float:
+        # Descarta conexões ociosas antes do keep-alive de 5s do uvicorn (evita ReadError ao reaproveitar
+        # uma conexão que o servidor acabou de fechar)
+        limits = httpx.Limits(max_connections=self.args.concurrency * self.args.image_parallelism, keepalive_expiry=2.0)
+        async with httpx.AsyncClient(timeout=self.args.request_timeout, limits=limits) as client:
+            start = time.monotonic()
+            deadline = start + self.args.duration
+            await asyncio.gather(*(self.virtual_user(client, deadline) for _ in range(self.args.concurrency)))
+            return time.monotonic() - start
+
+
+async def sample_memory(master_pid: int, peaks: dict, stop: asyncio.Event):
+    while not stop.is_set():
+        for pid in worker_pids(master_pid):
+            peaks[pid] = max(peaks.get(pid, 0.0), process_rss_mb(pid))
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+
+
+def build_report(args, test: LoadTest, elapsed: float, upstream_stats: dict, memory: dict) -> dict:
+    total = sum(len(v) for v in test.samples.values())
+    latencies = {}
+    for kind, values in sorted(test.samples.items()):
+        values.sort()
+        latencies[kind] = {
+            "count": len(values),
+            "errors": dict(test.errors.get(kind, {})),
+            "mean_ms": round(1000 * sum(values) / len(values), 2),
+            "p50_ms": round(1000 * percentile(values, 0.50), 2),
+            "p95_ms": round(1000 * percentile(values, 0.95), 2),
+            "p99_ms": round(1000 * percentile(values, 0.99), 2),
+        }
+    upstream_requests = upstream_stats.get("requests", 0)
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output", "app_log")},
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "scenarios": dict(test.scenarios),
+        "page_dimensions": dict(test.page_dimensions),
+        "latency": latencies,
+        "upstream": {
+            **upstream_stats,
+            "requests_per_api_request": round(upstream_requests / total, 3) if total else 0.0,
+        },
+        "memory_mb_per_worker": {str(pid): round(mb, 1) for pid, mb in sorted(memory.items())},
+    }
+
+
+def print_report(report: dict):
+    print(f"\nCommit {report['commit']} - {report['requests']} requisições em {report['elapsed_s']}s "
+          f"({report['throughput_rps']} req/s)")
+    print(f"{'tipo':<10}{'n':>8}{'erros':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, stats in report["latency"].items():
+        errors = sum(stats["errors"].values())
+        print(f"{kind:<10}{stats['count']:>8}{errors:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    upstream = report["upstream"]
+    print(f"upstream: {upstream.get('requests', 0)} requisições "
+          f"({upstream['requests_per_api_request']} por requisição à API), "
+          f"html={upstream.get('requests_html', 0)} imagens={upstream.get('requests_image', 0)}")
+    dimensions = report.get("page_dimensions", {})
+    print(f"páginas de capítulo com dimensões: {dimensions.get('with', 0)} "
+          f"de {dimensions.get('with', 0) + dimensions.get('without', 0)}")
+    print(f"memória (MB por worker): {report['memory_mb_per_worker']}")
+
+
+def print_comparison(report: dict, baseline: dict):
+    def delta(new, old):
+        if not old:
+            return "n/a"
+        return f"{100 * (new - old) / old:+.1f}%"
+
+    print(f"\nComparação com {baseline['commit']}:")
+    print(f"  vazão: {baseline['throughput_rps']} -> {report['throughput_rps']} req/s "
+          f"({delta(report['throughput_rps'], baseline['throughput_rps'])})")
+    for kind, stats in report["latency"].items():
+        old = baseline["latency"].get(kind)
+        if old:
+            print(f"  {kind:<10} p95 {old['p95_ms']} -> {stats['p95_ms']} ms ({delta(stats['p95_ms'], old['p95_ms'])}), "
+                  f"p99 {old['p99_ms']} -> {stats['p99_ms']} ms ({delta(stats['p99_ms'], old['p99_ms'])})")
+    old_up = baseline["upstream"]["requests_per_api_request"]
+    new_up = report["upstream"]["requests_per_api_request"]
+    print(f"  upstream por requisição: {old_up} -> {new_up} ({delta(new_up, old_up)})")
+    old_mem = max(baseline["memory_mb_per_worker"].values(), default=0)
+    new_mem = max(report["memory_mb_per_worker"].values(), default=0)
+    print(f"  memória máx. por worker: {old_mem} -> {new_mem} MB ({delta(new_mem, old_mem)})")
+
+
+async def main_async(args) -> dict:
+    upstream_port = free_port()
+    api_port = free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    api_url = f"http://127.0.0.1:{api_port}"
+
+    upstream = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "fake_upstream.py"),
+        "--port", str(upstream_port),
+        "--latency-ms", str(args.latency_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--rate-403", str(args.rate_403),
+        "--rate-429", str(args.rate_429),
+        "--challenge-rate", str(args.challenge_rate),
+        "--catalog-size", str(args.catalog_size),
+        "--chapters-per-manga", str(args.chapters_per_manga),
+        "--pages-per-chapter", str(args.images_per_chapter),
+        "--image-kb", str(args.image_kb),
+        "--fixtures", args.fixtures,
+        "--seed", str(args.seed),
+    ])
+
+    env = {**os.environ, "USE_PROXY": "false", "LERMANGAS_BASE_URL": upstream_url}
+    app_log = open(args.app_log, "w") if args.app_log else subprocess.DEVNULL
+    api = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "index:app",
+            "--app-dir", os.path.join(ROOT, "api"),
+            "--port", str(api_port),
+            "--workers", str(args.workers),
+            "--log-level", "warning",
+            "--no-access-log",
+        ],
+        env=env, cwd=ROOT, stdout=app_log, stderr=subprocess.STDOUT,
+    )
+
+    try:
+        await wait_ready(f"{upstream_url}/__stats")
+        await wait_ready(f"{api_url}/api/")
+        async with httpx.AsyncClient() as client:
+            await client.post(f"{upstream_url}/__reset")
+
+        test = LoadTest(api_url, args)
+        memory = {}
+        stop = asyncio.Event()
+        sampler = asyncio.ensure_future(sample_memory(api.pid, memory, stop))
+        elapsed = await test.run()
+        stop.set()
+        await sampler
+
+        async with httpx.AsyncClient() as client:
+            upstream_stats = (await client.get(f"{upstream_url}/__stats")).json()
+        return build_report(args, test, elapsed, upstream_stats, memory)
+    finally:
+        for process in (api, upstream):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if app_log is not subprocess.DEVNULL:
+            app_log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga da API contra upstream simulado")
+    parser.add_argument("--duration", type=float, default=30.0, help="Duração em segundos")
+    parser.add_argument("--concurrency", type=int, default=20, help="Leitores simultâneos")
+    parser.add_argument("--workers", type=int, default=1, help="Workers do uvicorn")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pausa máxima entre ações de um leitor")
+    parser.add_argument("--images-per-chapter", type=int, default=20)
+    parser.add_argument("--image-parallelism", type=int, default=4)
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--catalog-size", type=int, default=200)
+    parser.add_argument("--chapters-per-manga", type=int, default=80)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Concentração da popularidade dos mangás")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Latência do upstream")
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--rate-403", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--challenge-rate", type=float, default=0.0)
+    parser.add_argument("--image-kb", type=int, default=150)
+    parser.add_argument("--fixtures", default="", help="Diretório com HTML gravado do site real")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="", help="Arquivo do relatório (padrão: loadtest/reports/<commit>.json)")
+    parser.add_argument("--compare", default="", help="Relatório anterior para comparação")
+    parser.add_argument("--app-log", default="", help="Arquivo para o log da API")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    print_report(report)
+
+    output = args.output or os.path.join(HERE, "reports", f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nRelatório salvo em {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -477,7 +477,7 @@ const ChapterItem = ({ chapter, mangaId, source, isCurrentlyReading = false }) =
 
       // Download all images
       for (let i = 0; i < pages.length; i++) {
-        const pageUrl = pages[i];
+        const pageUrl = typeof pages[i] === 'string' ? pages[i] : pages[i].url;
         
         try {
           const blob = await downloadImageWithRetry(pageUrl);
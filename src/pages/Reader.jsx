@@ -205,10 +205,10 @@ const Reader = () => {
 
       {/* Pages */}
       <div className="max-w-4xl mx-auto space-y-2">
-        {pages.map((pageUrl, index) => (
+        {pages.map((page, index) => (
           <PageImage 
             key={index} 
-            pageUrl={pageUrl} 
+            page={page} 
             index={index}
             pageRef={(el) => (pageRefs.current[index] = el)}
           />
@@ -370,13 +370,21 @@ const Reader = () => {
   );
 };
 
-// Componente para carregar cada página com skeleton loading
-const PageImage = ({ pageUrl, index, pageRef }) => {
+// Componente para carregar cada página com skeleton loading.
+// `page` é a URL ou { url, width, height } (LerManga); com as dimensões o espaço da
+// página é reservado antes da imagem chegar e as páginas distantes podem carregar sob demanda
+const PageImage = ({ page, index, pageRef }) => {
   const [isLoading, setIsLoading] = useState(true);
   const [hasError, setHasError] = useState(false);
 
+  const pageUrl = typeof page === 'string' ? page : page.url;
+  const hasDimensions = typeof page !== 'string' && page.width > 0 && page.height > 0;
+
   return (
-    <div className="relative min-h-[600px] bg-surface rounded-lg overflow-hidden">
+    <div
+      className={`relative bg-surface rounded-lg overflow-hidden ${hasDimensions ? '' : 'min-h-[600px]'}`}
+      style={hasDimensions ? { aspectRatio: `${page.width} / ${page.height}` } : undefined}
+    >
       {/* Skeleton Loading */}
       {isLoading && (
         <div className="absolute inset-0 flex flex-col items-center justify-center">
@@ -405,6 +413,8 @@ const PageImage = ({ pageUrl, index, pageRef }) => {
       <img
         ref={pageRef}
         src={pageUrl}
+        width={hasDimensions ? page.width : undefined}
+        height={hasDimensions ? page.height : undefined}
         alt={`Página ${index + 1}`}
         className={`w-full h-auto block transition-opacity duration-300 ${
           isLoading ? 'opacity-0' : 'opacity-100'
@@ -414,7 +424,7 @@ const PageImage = ({ pageUrl, index, pageRef }) => {
           setIsLoading(false);
           setHasError(true);
         }}
-        loading="eager"
+        loading={hasDimensions && index >= 3 ? 'lazy' : 'eager'}
         decoding="async"
         fetchPriority={index < 3 ? 'high' : 'auto'}
       />
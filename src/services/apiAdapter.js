@@ -16,11 +16,38 @@ export const getPopularMangas = async () => {
 
 /**
  * Search mangas by text query
- * Fetches from BOTH APIs and merges results
+ * Uses the backend federated search (both APIs, deduplicated and ranked);
+ * falls back to querying both APIs from the browser if it is unavailable
  * @param {string} query - Search query
  * @returns {Promise<Array>} Combined results from both APIs
  */
 export const searchMangas = async (query) => {
+  try {
+    const { results } = await lerMangaService.federatedSearch(query);
+    
+    return results.map(result => {
+      // Prefer MangaDex as the reading source when the title exists in both
+      const primary = result.sources.find(s => s.source === 'mangadex') || result.sources[0];
+      const cover = primary.source === 'mangadex'
+        ? mangaDexService.proxyMangaDexImage(primary.cover_image)
+        : primary.cover_image || result.cover_image;
+      
+      return {
+        id: primary.id,
+        slug: primary.source === 'lermanga' ? primary.id : undefined,
+        title: result.title,
+        cover,
+        description: result.description,
+        rating: result.rating,
+        url: primary.url,
+        sources: result.sources,
+        source: primary.source
+      };
+    });
+  } catch (error) {
+    console.warn('Federated search unavailable, querying APIs directly:', error);
+  }
+  
   try {
     // Fetch from both APIs in parallel
     const [mangaDexResults, lerMangaResults] = await Promise.allSettled([
@@ -146,7 +173,7 @@ export const getChapterPages = async (chapterId, source = 'mangadex', mangaId =
       return [];
     }
     
-    // fetchChapterBySlugAndNumber now returns the images array directly
+    // fetchChapterBySlugAndNumber returns pages as { url, width, height }
     return await lerMangaService.fetchChapterBySlugAndNumber(mangaId, chapterId);
   }
   
@@ -39,6 +39,20 @@ export const searchMangas = async (query) => {
   }
 };
 
+/**
+ * Federated search (MangaDex + LerManga) merged and deduplicated by the backend
+ * @param {string} query - Search query
+ * @returns {Promise<Object>} { results, source_status, partial }
+ */
+export const federatedSearch = async (query) => {
+  const url = `${LERMANGA_API_BASE}/search/federated?q=${encodeURIComponent(query)}`;
+  
+  const response = await fetch(url);
+  if (!response.ok) throw new Error('Failed to run federated search');
+  
+  return await response.json();
+};
+
 /**
  * Filter mangas by genres/tags
  * @param {Object} filters - Filter options
@@ -167,22 +181,27 @@ export const fetchChapter = async (chapterId) => {
  * Get chapter by manga slug and chapter number
  * @param {string} slug - The manga slug
  * @param {string} chapterNumber - The chapter number
- * @returns {Promise<string[]>} Array of image URLs (proxied)
+ * @returns {Promise<Array<{url: string, width: ?number, height: ?number}>>} Pages (proxied URLs + dimensions)
  */
 export const fetchChapterBySlugAndNumber = async (slug, chapterNumber) => {
   try {
-    const url = `${LERMANGA_API_BASE}/manga/${slug}/chapter/${chapterNumber}`;
+    const url = `${LERMANGA_API_BASE}/manga/${slug}/chapter/${chapterNumber}?dimensions=true`;
     
     const response = await fetch(url);
     if (!response.ok) throw new Error('Failed to fetch chapter');
     
     const data = await response.json();
     
-    // Usar o proxy para as imagens evitar bloqueio de CORS/Referer
+    // Usar o proxy para as imagens evitar bloqueio de CORS/Referer.
+    // Largura/altura (das páginas que o backend já mediu; o resto é medido para as próximas leituras)
+    // deixam o leitor reservar o espaço da página
     const images = data.images || [];
-    return images.map(imageUrl => 
-      `${LERMANGA_API_BASE}/proxy-image?url=${encodeURIComponent(imageUrl)}`
-    );
+    const dimensions = data.pages || [];
+    return images.map((imageUrl, index) => ({
+      url: `${LERMANGA_API_BASE}/proxy-image?url=${encodeURIComponent(imageUrl)}`,
+      width: dimensions[index]?.width ?? null,
+      height: dimensions[index]?.height ?? null,
+    }));
   } catch (error) {
     console.error('Error fetching chapter:', error);
     throw error;
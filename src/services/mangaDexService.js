@@ -4,9 +4,6 @@
  * Based on the original base.html implementation
  */
 
-// Use CORS proxy for MangaDex API
-const CORS_PROXY = 'https://corsproxy.io/?';
-const MANGADEX_API_BASE = 'https://api.mangadex.org';
 const MANGADEX_COVER_BASE = 'https://uploads.mangadex.org';
 
 // Backend API base URL
@@ -14,8 +11,16 @@ const BACKEND_API_BASE = import.meta.env.PROD
   ? '/api'  // Em produção, usa a API serverless da Vercel
   : 'http://localhost:8000';  // Em desenvolvimento, usa localhost (rotas já têm /api/)
 
+// Helper: URL do gateway MangaDex no nosso backend (cache compartilhado + rate limit)
+const mangaDexApiUrl = (path, params) => {
+  // Produção: /api + /mangadex/... ; Dev: http://localhost:8000 + /api/mangadex/...
+  const prefix = import.meta.env.PROD ? '/mangadex' : '/api/mangadex';
+  const query = params ? `?${params.toString()}` : '';
+  return `${BACKEND_API_BASE}${prefix}${path}${query}`;
+};
+
 // Helper: Proxiar imagem do MangaDex através do nosso backend
-const proxyMangaDexImage = (imageUrl) => {
+export const proxyMangaDexImage = (imageUrl) => {
   if (!imageUrl) return 'https://via.placeholder.com/256x360?text=No+Cover';
   // Produção: /api + /mangadex-proxy = /api/mangadex-proxy
   // Dev: http://localhost:8000 + /api/mangadex-proxy = http://localhost:8000/api/mangadex-proxy
@@ -47,7 +52,12 @@ const mapStatusToPortuguese = (status) => {
  */
 export const fetchPopularMangas = async () => {
   try {
-    const url = `${CORS_PROXY}${encodeURIComponent(`${MANGADEX_API_BASE}/manga?limit=20&order[latestUploadedChapter]=desc&includes[]=cover_art&includes[]=author&availableTranslatedLanguage[]=pt-br&contentRating[]=safe&contentRating[]=suggestive`)}`;
+    const url = mangaDexApiUrl('/manga', new URLSearchParams([
+      ['limit', '20'],
+      ['order[latestUploadedChapter]', 'desc'],
+      ['includes[]', 'author'],
+      ['availableTranslatedLanguage[]', 'pt-br']
+    ]));
     
     const response = await fetch(url);
     if (!response.ok) throw new Error('Failed to fetch mangas');
@@ -97,7 +107,12 @@ export const fetchPopularMangas = async () => {
  */
 export const searchMangas = async (query) => {
   try {
-    const url = `${CORS_PROXY}${encodeURIComponent(`${MANGADEX_API_BASE}/manga?title=${query}&limit=20&includes[]=cover_art&includes[]=author&availableTranslatedLanguage[]=pt-br&contentRating[]=safe&contentRating[]=suggestive`)}`;
+    const url = mangaDexApiUrl('/manga', new URLSearchParams([
+      ['title', query],
+      ['limit', '20'],
+      ['includes[]', 'author'],
+      ['availableTranslatedLanguage[]', 'pt-br']
+    ]));
     
     const response = await fetch(url);
     if (!response.ok) throw new Error('Failed to search mangas');
@@ -146,7 +161,7 @@ export const searchMangas = async (query) => {
  */
 export const fetchMangaDetails = async (mangaId) => {
   try {
-    const url = `${CORS_PROXY}${encodeURIComponent(`${MANGADEX_API_BASE}/manga/${mangaId}?includes[]=cover_art&includes[]=author`)}`;
+    const url = mangaDexApiUrl(`/manga/${mangaId}`);
     
     const response = await fetch(url);
     if (!response.ok) throw new Error('Failed to fetch manga details');
@@ -187,7 +202,11 @@ export const fetchMangaDetails = async (mangaId) => {
  */
 export const fetchMangaChapters = async (mangaId, language = 'pt-br') => {
   try {
-    const url = `${CORS_PROXY}${encodeURIComponent(`${MANGADEX_API_BASE}/manga/${mangaId}/feed?translatedLanguage[]=${language}&order[chapter]=desc&limit=500`)}`;
+    const url = mangaDexApiUrl(`/manga/${mangaId}/feed`, new URLSearchParams([
+      ['translatedLanguage[]', language],
+      ['order[chapter]', 'desc'],
+      ['limit', '500']
+    ]));
     
     const response = await fetch(url);
     if (!response.ok) throw new Error('Failed to fetch chapters');
@@ -217,7 +236,7 @@ export const fetchMangaChapters = async (mangaId, language = 'pt-br') => {
  */
 export const fetchChapterPages = async (chapterId) => {
   try {
-    const url = `${CORS_PROXY}${encodeURIComponent(`${MANGADEX_API_BASE}/at-home/server/${chapterId}`)}`;
+    const url = mangaDexApiUrl(`/at-home/${chapterId}`);
     
     const response = await fetch(url);
     if (!response.ok) throw new Error('Failed to fetch chapter pages');
@@ -247,7 +266,7 @@ export const fetchChapterPages = async (chapterId) => {
  */
 export const fetchTags = async () => {
   try {
-    const url = `${CORS_PROXY}${encodeURIComponent(`${MANGADEX_API_BASE}/manga/tag`)}`;
+    const url = mangaDexApiUrl('/tags');
     
     const response = await fetch(url);
     if (!response.ok) throw new Error('Failed to fetch tags');
@@ -278,15 +297,11 @@ export const filterMangasByTags = async (filters = {}) => {
     
     // Basic params
     params.append('limit', '20');
-    params.append('includes[]', 'cover_art');
-    params.append('includes[]', 'author');
+    params.append('includes[]', 'author'); // cover_art é expandido pelo backend
     params.append('availableTranslatedLanguage[]', 'pt-br');
     params.append('order[latestUploadedChapter]', 'desc');
     
-    // Content rating filter - Excluir conteúdo adulto por padrão
-    params.append('contentRating[]', 'safe');
-    params.append('contentRating[]', 'suggestive');
-    // Não incluir: 'erotica' e 'pornographic'
+    // Content rating: o backend exclui conteúdo adulto por padrão (safe + suggestive)
     
     // Included tags
     if (filters.includedTags && filters.includedTags.length > 0) {
@@ -302,7 +317,7 @@ export const filterMangasByTags = async (filters = {}) => {
       });
     }
     
-    const url = `${CORS_PROXY}${encodeURIComponent(`${MANGADEX_API_BASE}/manga?${params.toString()}`)}`;
+    const url = mangaDexApiUrl('/manga', params);
     
     const response = await fetch(url);
     if (!response.ok) throw new Error('Failed to filter mangas');